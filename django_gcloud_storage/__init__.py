@@ -1,27 +1,52 @@
 # -*- encoding: utf-8 -*-
 from __future__ import unicode_literals
 
+import base64
+import asyncio
+import copy
 import datetime
+import hashlib
+import hmac
+import io
 import os
+import posixpath
+from http.cookies import Morsel
 import re
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
 from tempfile import SpooledTemporaryFile
 import mimetypes
 import urllib.parse
 
 import django
 from django.conf import settings
-from django.core.exceptions import SuspiciousFileOperation
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation, SuspiciousOperation
 from django.core.files.base import File
 from django.core.files.storage import Storage
 from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
 from django.utils.encoding import force_str, smart_str
+from django.utils.http import http_date
 from google.cloud import _helpers as gcloud_helpers
 from google.cloud import storage
-from google.cloud.exceptions import NotFound
+from google.cloud.exceptions import NotFound, PreconditionFailed
 from google.cloud.storage.bucket import Bucket
 
 __version__ = '0.5.0'
 
+# Size of the ranged requests used when streaming blob content
+DEFAULT_CHUNK_SIZE = 2 * 1024 * 1024
+
+CDN_COOKIE_NAME = "Cloud-CDN-Cookie"
+
+DIRECT_UPLOAD_SALT = "django_gcloud_storage.direct_upload"
+# Seconds a direct upload token can be finalized after it was issued
+DIRECT_UPLOAD_MAX_AGE = 24 * 60 * 60
+
 
 def safe_join(base, path):
     base = force_str(base).replace("\\", "/").lstrip("/").rstrip("/") + "/"
@@ -53,32 +78,304 @@ def remove_prefix(target, prefix):
     return target
 
 
+def _cdn_signature(value, key):
+    digest = hmac.new(base64.urlsafe_b64decode(key), value.encode("utf-8"), hashlib.sha1).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+def sign_cdn_url(url, key_name, key, expiration):
+    """
+    Signs url for Cloud CDN with the base64url encoded HMAC key named key_name
+
+    :type expiration: datetime.datetime
+    """
+    url = "{}{}Expires={}&KeyName={}".format(
+        url,
+        "&" if "?" in url else "?",
+        int(expiration.timestamp()),
+        key_name
+    )
+    return "{}&Signature={}".format(url, _cdn_signature(url, key))
+
+
+def sign_cdn_cookie(url_prefix, key_name, key, expiration):
+    """
+    Returns the value of a Cloud CDN signed cookie granting access to all URLs
+    starting with url_prefix
+
+    :type expiration: datetime.datetime
+    """
+    policy = "URLPrefix={}:Expires={}:KeyName={}".format(
+        base64.urlsafe_b64encode(url_prefix.encode("utf-8")).decode("ascii"),
+        int(expiration.timestamp()),
+        key_name
+    )
+    return "{}:Signature={}".format(policy, _cdn_signature(policy, key))
+
+
+def content_address(name, content):
+    """
+    Returns the content addressed name for name: the SHA-256 hex digest of the
+    django File content in the directory of name, keeping its extension
+    """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+
+    return _digest_name(name, digest)
+
+
+def _digest_name(name, digest):
+    dirname, basename = posixpath.split(name)
+    _, ext = posixpath.splitext(basename)
+
+    return posixpath.join(dirname, digest.hexdigest() + ext.lower())
+
+
+def iter_blob_chunks(blob, start=0, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generator that downloads the bytes start to end (inclusive) of blob with
+    ranged requests of at most chunk_size bytes each, so only one chunk is
+    held in memory at a time.
+
+    All requests are pinned to the generation of the given blob, a concurrent
+    overwrite will raise instead of mixing two versions of the content.
+
+    :type blob: google.cloud.storage.blob.Blob
+    """
+    if end is None:
+        end = blob.size - 1
+
+    while start <= end:
+        chunk_end = min(start + chunk_size - 1, end)
+        yield blob.download_as_bytes(
+            start=start,
+            end=chunk_end,
+            if_generation_match=blob.generation
+        )
+        start = chunk_end + 1
+
+
+@deconstructible
+class NamingStrategy(object):
+    """
+    Maps storage names, as stored in models, to object names in GCS and back.
+    The default keeps names unchanged.
+
+    Strategies that preserve directories may only change the last path
+    component, otherwise listdir() can't be supported.
+    """
+    preserves_directories = True
+
+    def to_key(self, name):
+        return name
+
+    def from_key(self, key):
+        return key
+
+
+@deconstructible
+class HashPrefixNamingStrategy(NamingStrategy):
+    """
+    Prefixes names with a short hash of the name, spreading sequential names
+    over the whole key range of the bucket: "a/1.jpg" -> "8ff3/a/1.jpg"
+    """
+    preserves_directories = False
+
+    def __init__(self, length=4):
+        self.length = length
+
+    def to_key(self, name):
+        digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+        return "{}/{}".format(digest[:self.length], name)
+
+    def from_key(self, key):
+        return key.split("/", 1)[1]
+
+
+@deconstructible
+class ReversedNamingStrategy(NamingStrategy):
+    """
+    Reverses file names without extension, so names that only differ at their
+    end, like timestamps or sequential ids, differ at their start instead:
+    "invoices/12345.pdf" -> "invoices/54321.pdf"
+    """
+
+    def to_key(self, name):
+        dirname, basename = posixpath.split(name)
+        stem, ext = posixpath.splitext(basename)
+        return posixpath.join(dirname, stem[::-1] + ext)
+
+    def from_key(self, key):
+        return self.to_key(key)
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key: while a call is in flight,
+    further callers wait for it and share its result or exception instead of
+    repeating the request. Works for threads and, through aget(), asyncio.
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.future = Future()
+            self.followers = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, share=None):
+        """
+        Returns the result of fn(), or of the call with the same key already in
+        flight. If given, share(result) is called once by the caller running fn
+        if others joined, they get its return value instead of result. Use it
+        for results that must not be used by several callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = self._Call()
+                leader = True
+
+        if not leader:
+            return call.future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.future.set_exception(e)
+            raise
+
+        with self._lock:
+            # Nobody can join after this point
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            followers = call.followers
+
+        if followers and share is not None:
+            try:
+                call.future.set_result(share(result))
+            except BaseException as e:
+                call.future.set_exception(e)
+                raise
+        else:
+            call.future.set_result(result)
+
+        return result
+
+    async def ado(self, key, fn, share=None):
+        """
+        Like do() for coroutines, fn is run in the default executor and waiting
+        for calls in flight doesn't block the event loop
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+
+        if call is not None:
+            # Cancelling a waiter must not cancel the call shared with others
+            return await asyncio.shield(asyncio.wrap_future(call.future))
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.do, key, fn, share)
+
+    def forget(self, key):
+        """
+        Lets later callers start a new call for key instead of joining the one
+        in flight, e.g. because its result is outdated by a write
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+_single_flight = SingleFlight()
+
+
+def _forget_lookup(bucket_name, name):
+    # Lookups started before a write would return the object as it was before
+    _single_flight.forget(("get_blob", bucket_name, name))
+
+
+def _copy_blob(blob):
+    """
+    Returns a copy of blob with its own properties, so coalesced get_blob()
+    callers can change their blob independently
+    """
+    if blob is None:
+        return None
+
+    copied = copy.copy(blob)
+    copied._properties = copy.deepcopy(blob._properties)
+    copied._changes = set(blob._changes)
+    return copied
+
+
+class _SharedDownload(object):
+    """
+    Downloaded content shared by coalesced _open() calls
+    """
+
+    def __init__(self, source):
+        self._lock = threading.Lock()
+        self._file = SpooledTemporaryFile(max_size=DEFAULT_CHUNK_SIZE, prefix="django_gcloud_storage_")
+        source.seek(0)
+        shutil.copyfileobj(source, self._file)
+
+    def copy_to(self, target):
+        with self._lock:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, target)
+
+    def __del__(self):
+        self._file.close()
+
+
 class GCloudFile(File):
     """
     Django file object that wraps a SpooledTemporaryFile and remembers changes on
     write to reupload the file to GCS on close()
     """
 
-    def __init__(self, blob, maxsize=1000):
+    def __init__(self, blob, maxsize=1000, uploader=None, read_only=False):
         """
         :type blob: google.cloud.storage.blob.Blob
+        :type uploader: django_gcloud_storage.write_behind.WriteBehindUploader
         """
         self._dirty = False
+        self._read_only = read_only
         self._tmpfile = SpooledTemporaryFile(
             max_size=maxsize,
             prefix="django_gcloud_storage_"
         )
 
         self._blob = blob
+        self._uploader = uploader
 
         super(GCloudFile, self).__init__(self._tmpfile)
 
     def _update_blob(self):
+        if self._uploader is not None:
+            self._uploader.submit(self._blob.name, self, content_type=self._blob.content_type)
+            return
+
         # Specify explicit size to avoid problems with not yet spooled temporary files
         # Djangos File.size property already knows how to handle cases like this
         self._blob.upload_from_file(self._tmpfile, size=self.size, rewind=True)
+        _forget_lookup(self._blob.bucket.name, self._blob.name)
 
     def write(self, content):
+        if self._read_only:
+            raise io.UnsupportedOperation("{} can't be changed".format(self._blob.name))
         self._dirty = True
         super(GCloudFile, self).write(content)
 
@@ -94,9 +391,13 @@ class GCloudFile(File):
 @deconstructible
 class DjangoGCloudStorage(Storage):
 
-    def __init__(self, project=None, bucket=None, credentials_file_path=None, use_unsigned_urls=None):
+    def __init__(self, project=None, bucket=None, credentials_file_path=None, use_unsigned_urls=None,
+                 cdn_base_url=None, cdn_key_name=None, cdn_key=None, write_behind=None, write_behind_dir=None,
+                 content_addressed=None, naming_strategy=None, background_token_refresh=None):
+        self._credentials = None
         self._client = None
         self._bucket = None
+        self._uploader = None
 
         if bucket is not None:
             self.bucket_name = bucket
@@ -120,21 +421,97 @@ class DjangoGCloudStorage(Storage):
         else:
             self.use_unsigned_urls = getattr(settings, "GCS_USE_UNSIGNED_URLS", False)
 
+        if cdn_base_url is not None:
+            self.cdn_base_url = cdn_base_url
+        else:
+            self.cdn_base_url = getattr(settings, "GCS_CDN_BASE_URL", None)
+
+        if cdn_key_name is not None:
+            self.cdn_key_name = cdn_key_name
+        else:
+            self.cdn_key_name = getattr(settings, "GCS_CDN_KEY_NAME", None)
+
+        if cdn_key is not None:
+            self.cdn_key = cdn_key
+        else:
+            self.cdn_key = getattr(settings, "GCS_CDN_KEY", None)
+
+        assert self.cdn_key_name or not self.cdn_key, "Cloud CDN key name is required for the key"
+
+        if write_behind is not None:
+            self.write_behind = write_behind
+        else:
+            self.write_behind = getattr(settings, "GCS_WRITE_BEHIND", False)
+
+        if write_behind_dir is not None:
+            self.write_behind_dir = write_behind_dir
+        else:
+            self.write_behind_dir = getattr(
+                settings,
+                "GCS_WRITE_BEHIND_DIR",
+                os.path.join(tempfile.gettempdir(), "django_gcloud_storage_journal")
+            )
+
+        if content_addressed is not None:
+            self.content_addressed = content_addressed
+        else:
+            self.content_addressed = getattr(settings, "GCS_CONTENT_ADDRESSED", False)
+
+        if background_token_refresh is not None:
+            self.background_token_refresh = background_token_refresh
+        else:
+            self.background_token_refresh = getattr(settings, "GCS_BACKGROUND_TOKEN_REFRESH", False)
+
+        if naming_strategy is None:
+            naming_strategy = getattr(settings, "GCS_NAMING_STRATEGY", NamingStrategy())
+        if isinstance(naming_strategy, str):
+            naming_strategy = import_string(naming_strategy)()
+        self.naming_strategy = naming_strategy
+
         self.bucket_subdir = ''  # TODO should be a parameter
         self.default_content_type = 'application/octet-stream'
 
+    @property
+    def credentials(self):
+        """
+        Service account credentials, shared with all storage instances using the
+        same credentials file
+
+        :rtype: google.oauth2.service_account.Credentials
+        """
+        if not self._credentials:
+            from django_gcloud_storage.auth import get_credentials
+
+            self._credentials = get_credentials(
+                self.credentials_file_path,
+                background_refresh=self.background_token_refresh,
+                refresh_margin=getattr(settings, "GCS_TOKEN_REFRESH_MARGIN", 300)
+            )
+        return self._credentials
+
     @property
     def client(self):
         """
         :rtype: storage.Client
         """
         if not self._client:
-            self._client = storage.Client.from_service_account_json(
-                self.credentials_file_path,
-                project=self.project_name
+            self._client = storage.Client(
+                project=self.project_name or self.credentials.project_id,
+                credentials=self.credentials
             )
         return self._client
 
+    def warm_up(self):
+        """
+        Creates the client, fetches an access token and the bucket, so the first
+        requests don't have to. Meant to be called from AppConfig.ready().
+        """
+        if not self.credentials.valid:
+            from google.auth.transport.requests import Request
+
+            self.credentials.refresh(Request())
+        return self.bucket
+
     @property
     def bucket(self):
         """
@@ -144,9 +521,80 @@ class DjangoGCloudStorage(Storage):
             self._bucket = self.client.get_bucket(self.bucket_name)
         return self._bucket
 
+    @property
+    def uploader(self):
+        """
+        Background uploader used if write_behind is enabled, None otherwise
+
+        :rtype: django_gcloud_storage.write_behind.WriteBehindUploader
+        """
+        if self.write_behind and (not self._uploader or self._uploader.pid != os.getpid()):
+            from django_gcloud_storage.write_behind import get_uploader
+
+            self._uploader = get_uploader(
+                self,
+                self.write_behind_dir,
+                workers=getattr(settings, "GCS_WRITE_BEHIND_WORKERS", 4),
+                max_pending=getattr(settings, "GCS_WRITE_BEHIND_MAX_PENDING", 100)
+            )
+        return self._uploader
+
+    def _wait_pending(self, name):
+        if self.uploader is not None:
+            self.uploader.wait(name)
+
+    def wait(self, name, timeout=None):
+        """
+        Waits until pending write behind uploads of name finished. Returns False
+        on timeout and raises if the upload failed.
+        """
+        if self.uploader is None:
+            return True
+
+        name = self._key(name)
+
+        return self.uploader.wait(name, timeout=timeout)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all pending write behind uploads finished. Returns False on
+        timeout and raises if an upload failed.
+        """
+        if self.uploader is None:
+            return True
+
+        return self.uploader.flush(timeout=timeout)
+
+    def get_available_name(self, name, max_length=None):
+        if self.content_addressed:
+            # The name is replaced by the content address in _save anyway, it
+            # only has to fit
+            address = _digest_name(safe_join("", name), hashlib.sha256())
+            if max_length is not None and len(address) > max_length:
+                raise SuspiciousFileOperation(
+                    'Content addressed name "%s" is longer than %d characters. Please make sure '
+                    'that the corresponding file field allows sufficient "max_length".' % (address, max_length)
+                )
+            return name
+        return super(DjangoGCloudStorage, self).get_available_name(name, max_length=max_length)
+
     def _save(self, name, content):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        # The name that is returned and stored in the model, _key(name) is used
+        # for the object in GCS
+        name = safe_join("", name)
+
+        metadata = None
+        if self.content_addressed:
+            metadata = {"original_name": posixpath.basename(name)}
+            name = content_address(name, content)
+
+        key = self._key(name)
+
+        if self.content_addressed:
+            if self.uploader is not None and self.uploader.get_pending(key) is not None:
+                return name
+            if self._get_blob(key) is not None:
+                return name
 
         # Required for InMemoryUploadedFile objects, as they have no fileno
         total_bytes = None if not hasattr(content, 'size') else content.size
@@ -156,34 +604,282 @@ class DjangoGCloudStorage(Storage):
         content_type = getattr(content, 'content_type', None)
         content_type = content_type or _type or self.default_content_type
 
-        blob = self.bucket.blob(name)
+        if self.uploader is not None:
+            self.uploader.submit(key, content, content_type=content_type, metadata=metadata)
+            return name
+
+        blob = self.bucket.blob(key)
+        blob.metadata = metadata
+
+        if self.content_addressed:
+            try:
+                blob.upload_from_file(content, size=total_bytes, content_type=content_type, if_generation_match=0)
+            except PreconditionFailed:
+                # Same content was uploaded concurrently
+                pass
+            _forget_lookup(self.bucket_name, key)
+            return name
+
         blob.upload_from_file(content, size=total_bytes, content_type=content_type)
+        _forget_lookup(self.bucket_name, key)
+
+        return name
+
+    def save_stream(self, name, chunks, content_type=None, max_length=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Saves the bytes (or str) produced by the iterable chunks as name without
+        knowing the size in advance, e.g. for generated exports. Chunks are
+        uploaded through a resumable upload session as they are produced, only
+        chunk_size bytes (a multiple of 256 KiB) are buffered in memory.
+
+        Write behind mode is not used, content addressed names are computed
+        while uploading to a temporary object that is then copied. Returns the
+        name the file was saved as, like save().
+        """
+        name = self.get_available_name(name, max_length=max_length)
+        name = safe_join("", name)
+
+        _type, _ = mimetypes.guess_type(name)
+        content_type = content_type or _type or self.default_content_type
+
+        metadata = None
+        if self.content_addressed:
+            metadata = {"original_name": posixpath.basename(name)}
+            digest = hashlib.sha256()
+            key = self._key(posixpath.join(posixpath.dirname(name), ".upload-" + uuid.uuid4().hex))
+        else:
+            digest = None
+            key = self._key(name)
+
+        blob = self.bucket.blob(key)
+        blob.metadata = metadata
+        writer = blob.open("wb", content_type=content_type, chunk_size=chunk_size)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if digest is not None:
+                    digest.update(chunk)
+                writer.write(chunk)
+        except BaseException:
+            # Never finalize partial uploads
+            if hasattr(writer, "terminate"):
+                writer.terminate()
+            raise
+        writer.close()
+
+        if digest is None:
+            _forget_lookup(self.bucket_name, key)
+            return name
+
+        name = _digest_name(name, digest)
+
+        try:
+            self.bucket.copy_blob(blob, self.bucket, new_name=self._key(name), if_generation_match=0)
+        except PreconditionFailed:
+            # Same content exists already
+            pass
+        finally:
+            self.bucket.delete_blob(key)
+        _forget_lookup(self.bucket_name, self._key(name))
+
+        return name
+
+    def _direct_upload_name(self, name, max_size, max_length):
+        if self.content_addressed:
+            # Browsers upload to the final name, it can't be a content address
+            raise NotImplementedError("Direct uploads aren't supported in content addressed mode")
+
+        # get_available_name() only knows existing objects, concurrent uploads
+        # of the same name need a unique name each
+        dir_name, file_name = posixpath.split(safe_join("", name))
+        file_root, file_ext = posixpath.splitext(file_name)
+        name = posixpath.join(dir_name, self.get_alternative_name(file_root, file_ext))
+
+        name = self.get_available_name(name, max_length=max_length)
+        name = safe_join("", name)
+
+        token = signing.dumps({"name": name, "max_size": max_size}, salt=DIRECT_UPLOAD_SALT)
+
+        return name, token
+
+    def generate_upload_policy(self, name, content_type=None, max_size=None, expiration=None, max_length=None):
+        """
+        Returns a V4 signed POST policy that allows a browser to upload a file
+        as name directly to GCS, as a dict with the form "url" and "fields".
+        The file has to be posted as the last field named "file".
+
+        The returned "token" has to be passed to finalize_direct_upload() after
+        the upload to get the name of the file, e.g. through DirectUploadField.
+
+        :type expiration: datetime.timedelta
+        """
+        name, token = self._direct_upload_name(name, max_size, max_length)
+
+        conditions = []
+        if max_size is not None:
+            conditions.append(["content-length-range", 0, max_size])
+        fields = {}
+        if content_type:
+            fields["Content-Type"] = content_type
+
+        policy = self.client.generate_signed_post_policy_v4(
+            self.bucket_name,
+            self._key(name),
+            expiration=expiration or datetime.timedelta(hours=1),
+            conditions=conditions,
+            fields=fields,
+            scheme="https"
+        )
+
+        return {"url": policy["url"], "fields": policy["fields"], "name": name, "token": token}
+
+    def create_upload_session(self, name, content_type=None, size=None, origin=None, max_length=None):
+        """
+        Creates a resumable upload session that allows a browser to upload a
+        file as name directly to GCS. Returns a dict with the session "url" and
+        a "token" for finalize_direct_upload(). If given, the upload must be
+        exactly size bytes. Pass the origin of the page to allow CORS requests.
+        """
+        name, token = self._direct_upload_name(name, size, max_length)
+
+        blob = self.bucket.blob(self._key(name))
+        url = blob.create_resumable_upload_session(
+            content_type=content_type,
+            size=size,
+            origin=origin,
+            if_generation_match=0
+        )
+
+        return {"url": url, "name": name, "token": token}
+
+    def finalize_direct_upload(self, token, max_age=DIRECT_UPLOAD_MAX_AGE):
+        """
+        Checks the file uploaded with a token of generate_upload_policy() or
+        create_upload_session() and returns its name.
+
+        Raises SuspiciousOperation for invalid tokens, FileNotFoundError if the
+        file wasn't uploaded and ValueError if it's larger than allowed, in
+        which case it is deleted.
+        """
+        try:
+            upload = signing.loads(token, salt=DIRECT_UPLOAD_SALT, max_age=max_age)
+        except signing.BadSignature:
+            raise SuspiciousOperation("Invalid direct upload token")
+
+        name = upload["name"]
+
+        # The browser uploaded the file, lookups in flight may have missed it
+        _forget_lookup(self.bucket_name, self._key(name))
+        blob = self.get_blob(name)
+        if blob is None:
+            raise FileNotFoundError("\"{}\" has not been uploaded".format(name))
+
+        if upload["max_size"] is not None and blob.size > upload["max_size"]:
+            self.purge(name)
+            raise ValueError("\"{}\" is larger than {} bytes".format(name, upload["max_size"]))
 
         return name
 
     def _open(self, name, mode):
         # TODO implement mode?
 
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        name = self._key(name)
 
-        blob = self.bucket.get_blob(name)
+        pending = self.uploader.get_pending(name) if self.uploader is not None else None
+        if pending is not None:
+            # Not uploaded yet, serve the journaled copy
+            blob = self.bucket.blob(name)
+            blob.content_type = pending.content_type
+            tmpfile = GCloudFile(blob, uploader=self.uploader, read_only=self.content_addressed)
+            try:
+                with open(pending.data_path, "rb") as f:
+                    # Write to the wrapped file directly to not mark it as dirty
+                    shutil.copyfileobj(f, tmpfile._tmpfile)
+                tmpfile.seek(0)
+                return tmpfile
+            except FileNotFoundError:
+                # Upload finished in the meantime
+                tmpfile.close()
+
+        blob = self._get_blob(name)
         if blob is None:
             # Create new
             blob = self.bucket.blob(name)
-            tmpfile = GCloudFile(blob)
+            tmpfile = GCloudFile(blob, uploader=self.uploader, read_only=self.content_addressed)
         else:
-            tmpfile = GCloudFile(blob)
-            blob.download_to_file(tmpfile)
+            tmpfile = GCloudFile(blob, uploader=self.uploader, read_only=self.content_addressed)
+
+            def download():
+                # Write to the wrapped file directly to not mark it as dirty
+                blob.download_to_file(tmpfile._tmpfile)
+                return tmpfile
+
+            result = _single_flight.do(
+                ("download", self.bucket_name, name, blob.generation),
+                download,
+                share=_SharedDownload
+            )
+            if result is not tmpfile:
+                # Write to the wrapped file directly to not mark it as dirty
+                result.copy_to(tmpfile._tmpfile)
         tmpfile.seek(0)
 
         return tmpfile
 
-    def created_time(self, name):
+    def get_blob(self, name):
+        """
+        :rtype: google.cloud.storage.blob.Blob
+        """
+        name = self._key(name)
+
+        self._wait_pending(name)
+
+        return self._get_blob(name)
+
+    def _key(self, name):
+        """
+        Returns the name of the object in GCS for the storage name name
+        """
+        name = self.naming_strategy.to_key(safe_join("", name))
         name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        return prepare_name(name)
+
+    def _get_blob(self, name):
+        # Concurrent lookups share one request. Writes of this process make
+        # later lookups start a new request, writes of other processes or
+        # browsers may be missed by lookups in flight.
+        blob = _single_flight.do(
+            ("get_blob", self.bucket_name, name),
+            lambda: self.bucket.get_blob(name),
+            share=_copy_blob
+        )
+        return _copy_blob(blob)
+
+    async def aget_blob(self, name):
+        """
+        Coroutine version of get_blob()
+
+        :rtype: google.cloud.storage.blob.Blob
+        """
+        name = self._key(name)
 
-        blob = self.bucket.get_blob(name)
+        if self.uploader is not None and self.uploader.get_pending(name) is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._wait_pending, name)
+
+        blob = await _single_flight.ado(
+            ("get_blob", self.bucket_name, name),
+            lambda: self.bucket.get_blob(name),
+            share=_copy_blob
+        )
+        return _copy_blob(blob)
+
+    def created_time(self, name):
+        name = self._key(name)
+
+        self._wait_pending(name)
+
+        blob = self._get_blob(name)
 
         # google.cloud doesn't provide a public method for this
         value = blob._properties.get("timeCreated", None)
@@ -192,37 +888,86 @@ class DjangoGCloudStorage(Storage):
             return naive.replace(tzinfo=gcloud_helpers.UTC)
 
     def delete(self, name):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        if self.content_addressed:
+            # Content addressed objects may be referenced by several names
+            return
+
+        self.purge(name)
+
+    def purge(self, name):
+        """
+        Deletes name like delete(), but also in content addressed mode. Every
+        file sharing the content is gone afterwards, use it to remove content
+        for good, e.g. for takedowns.
+        """
+        name = self._key(name)
+
+        if self.uploader is not None:
+            self.uploader.cancel(name)
 
         try:
             self.bucket.delete_blob(name)
         except NotFound:
             pass
+        _forget_lookup(self.bucket_name, name)
 
     def exists(self, name):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        name = self._key(name)
+
+        if self.uploader is not None and self.uploader.get_pending(name) is not None:
+            return True
 
-        return self.bucket.get_blob(name) is not None
+        return self._get_blob(name) is not None
 
     def size(self, name):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        name = self._key(name)
+
+        pending = self.uploader.get_pending(name) if self.uploader is not None else None
+        if pending is not None:
+            try:
+                return os.path.getsize(pending.data_path)
+            except FileNotFoundError:
+                # Upload finished in the meantime
+                pass
 
-        blob = self.bucket.get_blob(name)
+        blob = self._get_blob(name)
 
         return blob.size if blob is not None else None
 
     def get_modified_time(self, name):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        name = self._key(name)
+
+        self._wait_pending(name)
 
-        blob = self.bucket.get_blob(name)
+        blob = self._get_blob(name)
 
         return blob.updated if blob is not None else None
 
+    def original_name(self, name):
+        """
+        Returns the file name a content addressed object was first saved with
+        """
+        blob = self.get_blob(name)
+        if blob is None or not blob.metadata:
+            return None
+        return blob.metadata.get("original_name")
+
+    def stream_archive(self, names, archive_format="zip", **kwargs):
+        """
+        Returns a generator of a zip or tar archive of the files names, e.g. for
+        a StreamingHttpResponse. See django_gcloud_storage.archive.stream_archive
+        for the supported options.
+        """
+        from django_gcloud_storage.archive import stream_archive
+
+        return stream_archive(self, names, archive_format=archive_format, **kwargs)
+
     def listdir(self, path):
+        if not self.naming_strategy.preserves_directories:
+            raise NotImplementedError("{} doesn't support listing directories".format(
+                type(self.naming_strategy).__name__
+            ))
+
         path = safe_join(self.bucket_subdir, path)
         path = prepare_name(path)
 
@@ -231,7 +976,7 @@ class DjangoGCloudStorage(Storage):
             delimiter="/"
         )
 
-        items = [remove_prefix(blob.name, path) for blob in list(iterator)]
+        items = [self.naming_strategy.from_key(remove_prefix(blob.name, path)) for blob in list(iterator)]
         # prefixes is only set after first iterating the results!
         dirs = [remove_prefix(prefix, path).rstrip("/") for prefix in list(iterator.prefixes)]
 
@@ -241,10 +986,68 @@ class DjangoGCloudStorage(Storage):
         return dirs, items
 
     def url(self, name):
-        name = safe_join(self.bucket_subdir, name)
-        name = prepare_name(name)
+        name = self._key(name)
+
+        expiration = datetime.datetime.now() + datetime.timedelta(hours=1)
+
+        if self.cdn_base_url:
+            url = self._cdn_url(name)
+            if self.cdn_key:
+                url = sign_cdn_url(url, self.cdn_key_name, self.cdn_key, expiration)
+            return url
 
         if self.use_unsigned_urls:
           return "https://storage.googleapis.com/{}/{}".format(self.bucket.name, name)
 
-        return self.bucket.get_blob(name).generate_signed_url(expiration=datetime.datetime.now() + datetime.timedelta(hours=1))
+        self._wait_pending(name)
+
+        return self._get_blob(name).generate_signed_url(expiration=expiration)
+
+    def _cdn_url(self, name):
+        return "{}/{}".format(self.cdn_base_url.rstrip("/"), urllib.parse.quote(name))
+
+    def cdn_signed_cookie(self, path, expiration=None):
+        """
+        Returns the value for a signed cookie named CDN_COOKIE_NAME that grants
+        access to every object below the directory path through Cloud CDN
+
+        :type expiration: datetime.datetime
+        """
+        assert self.cdn_base_url and self.cdn_key and self.cdn_key_name, \
+            "Cloud CDN base url, key name and key are required"
+        assert self.naming_strategy.preserves_directories, "Naming strategy doesn't preserve directories"
+
+        path = safe_join(self.bucket_subdir, path)
+        path = prepare_name(path)
+        if not path.endswith("/"):
+            # The signed prefix would otherwise match siblings like "gallery/42-private"
+            path += "/"
+
+        if expiration is None:
+            expiration = datetime.datetime.now() + datetime.timedelta(hours=1)
+
+        return sign_cdn_cookie(self._cdn_url(path), self.cdn_key_name, self.cdn_key, expiration)
+
+    def set_cdn_signed_cookie(self, response, path, expiration=None, domain=None):
+        """
+        Sets the Cloud CDN signed cookie for path on a Django response. The
+        value is set verbatim, Django would otherwise quote it because of the
+        contained "=" characters.
+
+        :type response: django.http.HttpResponseBase
+        """
+        if expiration is None:
+            expiration = datetime.datetime.now() + datetime.timedelta(hours=1)
+
+        value = self.cdn_signed_cookie(path, expiration=expiration)
+
+        morsel = Morsel()
+        morsel.set(CDN_COOKIE_NAME, value, value)
+        morsel["path"] = "/"
+        morsel["expires"] = http_date(expiration.timestamp())
+        morsel["secure"] = True
+        morsel["httponly"] = True
+        if domain is not None:
+            morsel["domain"] = domain
+
+        response.cookies[CDN_COOKIE_NAME] = morsel
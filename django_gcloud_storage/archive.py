@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import queue
+import tarfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django_gcloud_storage import DEFAULT_CHUNK_SIZE, iter_blob_chunks
+
+ARCHIVE_FORMATS = ("zip", "tar")
+
+_END = object()
+
+
+class _Sink(object):
+    """
+    Write only file object collecting the output of ZipFile until drained
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _Member(object):
+    """
+    Fetches the blob of a single archive member in a worker thread and hands
+    its chunks to the consumer through a bounded queue
+    """
+
+    def __init__(self, storage, name, stop, chunk_size, prefetch_chunks):
+        self.name = name
+        self._storage = storage
+        self._stop = stop
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=prefetch_chunks)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(self):
+        try:
+            blob = self._storage.get_blob(self.name)
+            if blob is None:
+                raise FileNotFoundError("\"{}\" does not exist".format(self.name))
+
+            if not self._put(blob):
+                return
+            if blob.size:
+                for chunk in iter_blob_chunks(blob, chunk_size=self._chunk_size):
+                    if not self._put(chunk):
+                        return
+            self._put(_END)
+        except Exception as e:
+            self._put(e)
+
+    def _get(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    @property
+    def blob(self):
+        return self._get()
+
+    def __iter__(self):
+        while True:
+            chunk = self._get()
+            if chunk is _END:
+                return
+            yield chunk
+
+
+def _prefetch(storage, names, concurrency, chunk_size, prefetch_chunks):
+    """
+    Yields a _Member for each name in order while up to concurrency members are
+    being fetched in the background
+    """
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    window = deque()
+    names = iter(names)
+
+    def submit_next():
+        for name in names:
+            member = _Member(storage, name, stop, chunk_size, prefetch_chunks)
+            executor.submit(member.fetch)
+            window.append(member)
+            return
+
+    try:
+        for _ in range(concurrency):
+            submit_next()
+
+        while window:
+            member = window.popleft()
+            submit_next()
+            yield member
+    finally:
+        # Also stops blocked workers if the consumer went away
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def _zip_chunks(members, compression):
+    sink = _Sink()
+
+    with zipfile.ZipFile(sink, mode="w", compression=compression, allowZip64=True) as archive:
+        for member in members:
+            blob = member.blob
+
+            info = zipfile.ZipInfo(member.name, date_time=blob.updated.timetuple()[:6])
+            info.compress_type = compression
+            info.file_size = blob.size
+
+            with archive.open(info, mode="w") as dest:
+                yield sink.drain()
+                for chunk in member:
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+def _tar_chunks(members):
+    written = 0
+
+    for member in members:
+        blob = member.blob
+
+        info = tarfile.TarInfo(member.name)
+        info.size = blob.size
+        info.mtime = int(blob.updated.timestamp())
+        info.mode = 0o644
+
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="surrogateescape")
+        written += len(header)
+        yield header
+
+        for chunk in member:
+            written += len(chunk)
+            yield chunk
+
+        remainder = blob.size % tarfile.BLOCKSIZE
+        if remainder:
+            padding = tarfile.BLOCKSIZE - remainder
+            written += padding
+            yield tarfile.NUL * padding
+
+    # End of archive marker, padded to a full record
+    end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    written += len(end)
+    remainder = written % tarfile.RECORDSIZE
+    if remainder:
+        end += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    yield end
+
+
+def stream_archive(storage, names, archive_format="zip", compression=zipfile.ZIP_STORED, concurrency=4,
+                   chunk_size=DEFAULT_CHUNK_SIZE, prefetch_chunks=2):
+    """
+    Generator of a zip or tar archive of the files names in storage.
+
+    Members are downloaded in chunks by up to concurrency threads ahead of the
+    member currently written. At most prefetch_chunks chunks per member are
+    held in memory, neither files nor the archive are ever buffered completely.
+    """
+    assert archive_format in ARCHIVE_FORMATS, "Unsupported archive format: {}".format(archive_format)
+
+    members = _prefetch(storage, names, concurrency, chunk_size, prefetch_chunks)
+    try:
+        if archive_format == "zip":
+            chunks = _zip_chunks(members, compression)
+        else:
+            chunks = _tar_chunks(members)
+
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+    finally:
+        members.close()
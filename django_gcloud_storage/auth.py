@@ -0,0 +1,112 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import logging
+import os
+import threading
+
+from google.auth.transport.requests import Request
+from google.cloud import storage
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying a failed refresh
+RETRY_INTERVAL = 10
+
+_lock = threading.Lock()
+_credentials = {}
+_refreshers = {}
+
+
+def get_credentials(credentials_file_path, background_refresh=False, refresh_margin=300):
+    """
+    Returns the service account credentials for credentials_file_path, shared
+    by all storage instances of the process so the access token is only
+    fetched once.
+
+    If background_refresh is enabled, a thread refreshes the token
+    refresh_margin seconds before it expires so requests never have to.
+    """
+    with _lock:
+        credentials = _credentials.get(credentials_file_path)
+        if credentials is None:
+            # Scoped already, otherwise every client would create its own scoped copy
+            credentials = service_account.Credentials.from_service_account_file(
+                credentials_file_path,
+                scopes=storage.Client.SCOPE
+            )
+            _credentials[credentials_file_path] = credentials
+
+        if background_refresh and credentials_file_path not in _refreshers:
+            refresher = TokenRefresher(credentials, refresh_margin)
+            refresher.start()
+            _refreshers[credentials_file_path] = refresher
+
+    return credentials
+
+
+def _utcnow():
+    # google.auth uses naive UTC datetimes for expiry
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class TokenRefresher(threading.Thread):
+    """
+    Daemon thread refreshing the access token of credentials ahead of expiry
+    """
+
+    def __init__(self, credentials, margin):
+        super(TokenRefresher, self).__init__(name="django_gcloud_storage_token_refresher", daemon=True)
+        self.credentials = credentials
+        self.margin = datetime.timedelta(seconds=margin)
+        self._request = Request()
+        self._finished = threading.Event()
+
+    def refresh_if_needed(self):
+        """
+        Refreshes the token if it expires within the margin and returns the
+        seconds until the next refresh is due
+        """
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None or expiry - _utcnow() <= self.margin:
+            self.credentials.refresh(self._request)
+            expiry = self.credentials.expiry
+
+        if expiry is None:
+            # Token without expiry
+            return None
+
+        return max((expiry - _utcnow() - self.margin).total_seconds(), 1)
+
+    def run(self):
+        while not self._finished.is_set():
+            try:
+                timeout = self.refresh_if_needed()
+            except Exception:
+                logger.exception("Refreshing the access token failed")
+                timeout = RETRY_INTERVAL
+
+            if timeout is None:
+                return
+            self._finished.wait(timeout)
+
+    def stop(self):
+        self._finished.set()
+
+
+def _restart_refreshers():
+    # Threads don't survive fork(), e.g. the workers of gunicorn --preload
+    # would otherwise inherit refreshers that never run
+    global _lock
+    _lock = threading.Lock()
+
+    for credentials_file_path, refresher in list(_refreshers.items()):
+        refresher = TokenRefresher(refresher.credentials, refresher.margin.total_seconds())
+        refresher.start()
+        _refreshers[credentials_file_path] = refresher
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_refreshers)
@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django import forms
+from django.core.exceptions import SuspiciousOperation, ValidationError
+from django.core.files.storage import default_storage
+
+from django_gcloud_storage import DIRECT_UPLOAD_MAX_AGE
+
+
+class DirectUploadWidget(forms.HiddenInput):
+    """
+    File input that uploads the selected file directly to GCS using the policy
+    returned by a DirectUploadPolicyView at policy_url. Only the upload token
+    is submitted with the form.
+    """
+    template_name = "django_gcloud_storage/direct_upload_widget.html"
+
+    class Media:
+        js = ("django_gcloud_storage/direct_upload.js",)
+
+    def __init__(self, policy_url, attrs=None):
+        super(DirectUploadWidget, self).__init__(attrs)
+        self.policy_url = policy_url
+
+    def get_context(self, name, value, attrs):
+        context = super(DirectUploadWidget, self).get_context(name, value, attrs)
+        context["widget"]["policy_url"] = self.policy_url
+        return context
+
+
+class DirectUploadField(forms.CharField):
+    """
+    Form field for files uploaded directly to GCS. Cleans the submitted upload
+    token to the name of the uploaded file, which can be stored in a model
+    FileField of a ModelForm.
+    """
+    default_error_messages = {
+        "invalid": "The upload is invalid or has expired, please upload the file again.",
+        "missing": "The file has not been uploaded, please upload it again.",
+        "too_large": "The file is too large.",
+    }
+
+    def __init__(self, policy_url, storage=None, max_age=DIRECT_UPLOAD_MAX_AGE, **kwargs):
+        kwargs.setdefault("widget", DirectUploadWidget(policy_url))
+        super(DirectUploadField, self).__init__(**kwargs)
+        self.storage = storage or default_storage
+        self.max_age = max_age
+
+    def clean(self, value):
+        value = super(DirectUploadField, self).clean(value)
+        if not value:
+            return value
+
+        try:
+            return self.storage.finalize_direct_upload(value, max_age=self.max_age)
+        except SuspiciousOperation:
+            raise ValidationError(self.error_messages["invalid"], code="invalid")
+        except FileNotFoundError:
+            raise ValidationError(self.error_messages["missing"], code="missing")
+        except ValueError:
+            raise ValidationError(self.error_messages["too_large"], code="too_large")
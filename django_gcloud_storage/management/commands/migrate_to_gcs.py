@@ -0,0 +1,261 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import FileField
+
+from django_gcloud_storage import DjangoGCloudStorage
+
+COPIED = "copied"
+SKIPPED = "skipped"
+
+
+def _walk_key(name):
+    """
+    Sort key of name in the order of iter_walk: the files of a directory come
+    before its subdirectories
+    """
+    parts = name.split("/")
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+def _md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies files from the local file system to Google Cloud Storage, either "
+        "all files referenced by model FileFields or all files below a directory. "
+        "Progress is checkpointed to a state file, running the command again "
+        "resumes after the last checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source-root",
+            default=None,
+            help="Directory to copy files from. Defaults to MEDIA_ROOT."
+        )
+        parser.add_argument(
+            "--walk",
+            action="store_true",
+            help="Copy all files below the source root instead of the files referenced by models."
+        )
+        parser.add_argument(
+            "--state-file",
+            default="migrate_to_gcs.json",
+            help="File to store the progress in. Defaults to migrate_to_gcs.json."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=16,
+            help="Number of concurrent uploads. Defaults to 16."
+        )
+        parser.add_argument(
+            "--report-interval",
+            type=float,
+            default=10,
+            help="Seconds between progress reports and checkpoints. Defaults to 10."
+        )
+
+    def get_storage(self):
+        """
+        :rtype: DjangoGCloudStorage
+        """
+        return DjangoGCloudStorage()
+
+    def handle(self, *args, **options):
+        self.source = FileSystemStorage(location=options["source_root"] or settings.MEDIA_ROOT)
+        self.storage = self.get_storage()
+        self.state_file = options["state_file"]
+        self.walk = options["walk"]
+
+        self.state = self.load_state()
+        self.stats = {COPIED: 0, SKIPPED: 0, "failed": 0, "bytes": 0}
+        self.started = time.time()
+
+        # Retries stay in the saved state until they finished, failures of this
+        # run are collected in state["failed"]
+        self.retries = self.state["failed"]
+        self.state["failed"] = []
+        items = self.iter_items(self.state["position"])
+        if self.retries:
+            self.stdout.write("Retrying {} previously failed files".format(len(self.retries)))
+            items = self.chain_retries(list(self.retries), items)
+
+        self.run(items, options["workers"], options["report_interval"])
+
+        self.save_state()
+        self.report()
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state["walk"] != self.walk or state["source_root"] != self.source.location:
+                raise CommandError("State file {} belongs to a different migration".format(self.state_file))
+            if state["position"] is not None:
+                self.stdout.write("Resuming after {}".format(state["position"]))
+            return state
+
+        return {
+            "walk": self.walk,
+            "source_root": self.source.location,
+            "position": None,
+            "failed": [],
+        }
+
+    def save_state(self):
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(self.state, failed=self.retries + self.state["failed"]), f)
+        os.replace(tmp_path, self.state_file)
+
+    def chain_retries(self, retry, items):
+        for name in retry:
+            # Retries don't move the checkpoint
+            yield None, name
+        for item in items:
+            yield item
+
+    def iter_items(self, position):
+        """
+        Yields (position, name) tuples in a stable order. Items up to and
+        including position are skipped, position doesn't have to exist anymore.
+        """
+        if self.walk:
+            return self.iter_walk(position)
+        return self.iter_fields(position)
+
+    def iter_walk(self, position):
+        root = self.source.location
+        after = None if position is None else _walk_key(position)
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+
+            if after is not None:
+                dirname = os.path.relpath(dirpath, root).replace(os.sep, "/")
+                prefix = () if dirname == "." else _walk_key(dirname + "/")[:-1]
+                # Directories before the checkpoint were copied completely
+                dirnames[:] = [d for d in dirnames if prefix + ((1, d),) >= after[:len(prefix) + 1]]
+
+            for filename in sorted(filenames):
+                name = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, "/")
+                if after is None or _walk_key(name) > after:
+                    yield name, name
+
+    def iter_fields(self, position):
+        for model in sorted(apps.get_models(), key=lambda m: m._meta.label):
+            fields = [field for field in model._meta.concrete_fields if isinstance(field, FileField)]
+
+            for field in sorted(fields, key=lambda f: f.name):
+                queryset = model._default_manager.exclude(**{field.attname: ""}).order_by("pk")
+                if position is not None:
+                    current = (model._meta.label, field.name)
+                    if current < tuple(position[:2]):
+                        continue
+                    if current == tuple(position[:2]):
+                        queryset = queryset.filter(pk__gt=position[2])
+
+                for pk, name in queryset.values_list("pk", field.attname).iterator():
+                    if name:
+                        yield [model._meta.label, field.name, str(pk)], name
+
+    def copy(self, name):
+        path = self.source.path(name)
+        size = os.path.getsize(path)
+
+        target = self.storage._key(name)
+
+        blob = self.storage.bucket.get_blob(target)
+        if blob is not None and blob.size == size and (blob.md5_hash is None or blob.md5_hash == _md5(path)):
+            return SKIPPED, size
+
+        content_type = mimetypes.guess_type(name)[0] or self.storage.default_content_type
+        self.storage.bucket.blob(target).upload_from_filename(path, content_type=content_type)
+
+        return COPIED, size
+
+    def run(self, items, workers, report_interval):
+        # Items are completed out of order, the checkpoint is only moved past an
+        # item once all items before it are done
+        positions = {}
+        completed = set()
+        next_index = 0
+        submitted = 0
+        in_flight = {}
+        last_report = time.time()
+        items = iter(items)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for position, name in items:
+                    future = executor.submit(self.copy, name)
+                    in_flight[future] = (submitted, name)
+                    positions[submitted] = position
+                    submitted += 1
+                    if len(in_flight) >= workers * 2:
+                        break
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=report_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, name = in_flight.pop(future)
+                    if positions[index] is None:
+                        self.retries.remove(name)
+                    try:
+                        result, size = future.result()
+                    except Exception as e:
+                        self.stderr.write("Failed to copy {}: {}".format(name, e))
+                        self.stats["failed"] += 1
+                        self.state["failed"].append(name)
+                    else:
+                        self.stats[result] += 1
+                        if result == COPIED:
+                            self.stats["bytes"] += size
+                    completed.add(index)
+
+                while next_index in completed:
+                    completed.remove(next_index)
+                    position = positions.pop(next_index)
+                    if position is not None:
+                        self.state["position"] = position
+                    next_index += 1
+
+                if time.time() - last_report >= report_interval:
+                    self.save_state()
+                    self.report()
+                    last_report = time.time()
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 0.001)
+        files = self.stats[COPIED] + self.stats[SKIPPED]
+
+        self.stdout.write(
+            "{copied} copied, {skipped} skipped, {failed} failed, "
+            "{files_per_second:.1f} files/s, {mb_per_second:.2f} MB/s".format(
+                files_per_second=files / elapsed,
+                mb_per_second=self.stats["bytes"] / elapsed / 1024 / 1024,
+                **self.stats
+            )
+        )
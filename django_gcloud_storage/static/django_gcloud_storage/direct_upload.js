@@ -0,0 +1,62 @@
+// Uploads files selected in DirectUploadWidget inputs directly to GCS and
+// stores the upload token in the hidden input submitted with the form.
+(function () {
+  "use strict";
+
+  function getCookie(name) {
+    var match = document.cookie.match(new RegExp("(?:^|; )" + name + "=([^;]*)"));
+    return match ? decodeURIComponent(match[1]) : null;
+  }
+
+  function checkResponse(response) {
+    if (!response.ok) {
+      throw new Error("Request failed with status " + response.status);
+    }
+    return response;
+  }
+
+  function upload(input) {
+    var target = document.getElementById(input.getAttribute("data-direct-upload-target"));
+    var file = input.files[0];
+
+    target.value = "";
+    if (!file) {
+      return;
+    }
+
+    var request = new FormData();
+    request.append("name", file.name);
+    request.append("content_type", file.type || "application/octet-stream");
+
+    input.setAttribute("data-direct-upload-state", "uploading");
+
+    fetch(input.getAttribute("data-direct-upload-policy-url"), {
+      method: "POST",
+      body: request,
+      credentials: "same-origin",
+      headers: {"X-CSRFToken": getCookie("csrftoken")}
+    }).then(checkResponse).then(function (response) {
+      return response.json();
+    }).then(function (policy) {
+      var form = new FormData();
+      Object.keys(policy.fields).forEach(function (key) {
+        form.append(key, policy.fields[key]);
+      });
+      form.append("file", file);
+
+      return fetch(policy.url, {method: "POST", body: form}).then(checkResponse).then(function () {
+        target.value = policy.token;
+        input.setAttribute("data-direct-upload-state", "done");
+      });
+    }).catch(function (error) {
+      input.setAttribute("data-direct-upload-state", "failed");
+      input.dispatchEvent(new CustomEvent("direct-upload-failed", {bubbles: true, detail: error}));
+    });
+  }
+
+  document.addEventListener("change", function (event) {
+    if (event.target.hasAttribute && event.target.hasAttribute("data-direct-upload-policy-url")) {
+      upload(event.target);
+    }
+  });
+})();
@@ -0,0 +1,171 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import mimetypes
+import posixpath
+import re
+
+from django.core.files.storage import default_storage
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.generic import View
+
+from django_gcloud_storage import DEFAULT_CHUNK_SIZE, iter_blob_chunks
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range_header(header, size):
+    """
+    Parses a single byte range Range header into an inclusive (start, end)
+    tuple. Returns None if the header should be ignored (missing, malformed or
+    multiple ranges) and raises ValueError if the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        # Suffix range: the last n bytes
+        if not last:
+            return None
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+
+    return start, min(end, size - 1)
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+
+    if if_range.startswith(("W/", '"')):
+        # Weak etags must never be used for range requests
+        return if_range == etag
+
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date == last_modified
+
+
+def serve(request, path, storage=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams a file from a DjangoGCloudStorage in chunks without buffering it.
+
+    Supports single byte range requests (206) and answers If-None-Match and
+    If-Modified-Since with 304 based on the blob's etag and updated time.
+
+    To use, put a URL pattern such as::
+
+        from django_gcloud_storage.views import serve
+
+        path('media/<path:path>', serve)
+
+    in your URLconf or call it from your own view after checking permissions.
+    """
+    storage = storage or default_storage
+
+    blob = storage.get_blob(path)
+    if blob is None:
+        raise Http404("\"{}\" does not exist".format(path))
+
+    etag = quote_etag(blob.etag)
+    last_modified = int(blob.updated.timestamp())
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        if isinstance(not_modified, HttpResponseNotModified):
+            not_modified["ETag"] = etag
+            not_modified["Last-Modified"] = http_date(last_modified)
+        return not_modified
+
+    content_type = blob.content_type or mimetypes.guess_type(path)[0] or storage.default_content_type
+
+    byte_range = None
+    if _if_range_passes(request, etag, last_modified):
+        try:
+            byte_range = parse_range_header(request.META.get("HTTP_RANGE"), blob.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(blob.size)
+            return response
+
+    if byte_range is None:
+        start, end = 0, blob.size - 1
+    else:
+        start, end = byte_range
+
+    if request.method == "HEAD" or blob.size == 0:
+        content = []
+    else:
+        content = iter_blob_chunks(blob, start, end, chunk_size=chunk_size)
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Length"] = end - start + 1
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+
+    if byte_range is not None:
+        response.status_code = 206
+        response["Content-Range"] = "bytes {}-{}/{}".format(start, end, blob.size)
+
+    return response
+
+
+class DirectUploadPolicyView(View):
+    """
+    Returns a signed POST policy for uploading a file directly to GCS as JSON,
+    used by DirectUploadWidget. Expects the "name" and "content_type" of the
+    file as POST parameters.
+
+    Anyone allowed to access this view can upload files, protect it like any
+    other upload view, e.g.::
+
+        path('upload-policy', login_required(DirectUploadPolicyView.as_view(
+            upload_to="uploads",
+            max_size=100 * 1024 * 1024
+        )), name='upload_policy')
+    """
+    http_method_names = ["post"]
+    storage = None
+    upload_to = ""
+    max_size = None
+
+    def get_storage(self):
+        return self.storage or default_storage
+
+    def post(self, request, *args, **kwargs):
+        filename = request.POST.get("name")
+        if not filename:
+            return HttpResponseBadRequest("Missing file name")
+
+        storage = self.get_storage()
+        # Only the base name of the client's file is used
+        filename = posixpath.basename(filename.replace("\\", "/"))
+        if not filename:
+            return HttpResponseBadRequest("Invalid file name")
+        name = posixpath.join(self.upload_to, storage.generate_filename(filename))
+
+        policy = storage.generate_upload_policy(
+            name,
+            content_type=request.POST.get("content_type") or None,
+            max_size=self.max_size
+        )
+
+        return JsonResponse({"url": policy["url"], "fields": policy["fields"], "token": policy["token"]})
@@ -0,0 +1,308 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from django.core.files import locks
+
+from django_gcloud_storage import _forget_lookup
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying a failed upload, doubled after every further
+# failure up to MAX_RETRY_INTERVAL
+RETRY_INTERVAL = 1
+MAX_RETRY_INTERVAL = 5 * 60
+
+_uploaders = {}
+_uploaders_lock = threading.Lock()
+
+
+def get_uploader(storage, journal_dir, workers, max_pending):
+    """
+    Returns the uploader for the bucket of storage and journal_dir, creating it
+    on first use. Uploaders are shared by all storage instances of a process so
+    journal entries are only replayed once.
+    """
+    key = (storage.bucket_name, os.path.abspath(journal_dir))
+
+    with _uploaders_lock:
+        if key not in _uploaders:
+            _uploaders[key] = WriteBehindUploader(storage, journal_dir, workers, max_pending)
+        return _uploaders[key]
+
+
+class PendingUpload(object):
+    def __init__(self, entry_id, name, data_path, content_type, journal_file, metadata=None):
+        self.entry_id = entry_id
+        self.name = name
+        self.data_path = data_path
+        self.content_type = content_type
+        self.metadata = metadata
+        self.journal_file = journal_file
+        self.done = threading.Event()
+        self.error = None
+        self.attempts = 0
+
+
+class WriteBehindUploader(object):
+    """
+    Uploads content to GCS in background threads.
+
+    Submitted content is first written to a journal directory, an entry is only
+    removed from it after the upload succeeded. Entries left behind by a crashed
+    or restarted process are uploaded again the next time an uploader for the
+    same bucket and journal is created. Failed uploads are retried with
+    exponential backoff. Entries are locked while a process owns them, so
+    several processes can share a journal directory.
+    """
+
+    def __init__(self, storage, journal_dir, workers, max_pending):
+        self._storage = storage
+        self._bucket_name = storage.bucket_name
+        self._journal_dir = journal_dir
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = {}
+        self._uploading = set()
+        # Threads don't survive fork(), storages check it before using the uploader
+        self.pid = os.getpid()
+
+        os.makedirs(journal_dir, exist_ok=True)
+
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._work,
+                name="django_gcloud_storage_uploader_{}".format(i),
+                daemon=True
+            )
+            thread.start()
+
+        threading.Thread(target=self._recover, name="django_gcloud_storage_recovery", daemon=True).start()
+
+    def _entry_path(self, entry_id, extension):
+        return os.path.join(self._journal_dir, "{}.{}".format(entry_id, extension))
+
+    def submit(self, name, content, content_type=None, metadata=None):
+        """
+        Journals the content of the django File content and queues it for upload
+        as name. Blocks if max_pending uploads are already queued.
+        """
+        entry_id = "{:020d}-{}".format(time.time_ns(), uuid.uuid4().hex)
+        data_path = self._entry_path(entry_id, "data")
+        journal_path = self._entry_path(entry_id, "json")
+
+        with open(data_path, "wb") as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Lock the entry before it becomes visible to other processes
+        tmp_journal_path = journal_path + ".tmp"
+        journal_file = open(tmp_journal_path, "w")
+        locks.lock(journal_file, locks.LOCK_EX)
+        json.dump({
+            "bucket": self._bucket_name,
+            "name": name,
+            "content_type": content_type,
+            "metadata": metadata,
+        }, journal_file)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        os.replace(tmp_journal_path, journal_path)
+
+        upload = PendingUpload(entry_id, name, data_path, content_type, journal_file, metadata=metadata)
+        with self._lock:
+            self._pending[name] = upload
+        self._queue.put(upload)
+
+        return upload
+
+    def _recover(self):
+        for filename in sorted(os.listdir(self._journal_dir)):
+            if not filename.endswith(".json"):
+                continue
+
+            entry_id = filename[:-len(".json")]
+            journal_file = None
+            try:
+                journal_file = open(self._entry_path(entry_id, "json"), "r")
+                if not locks.lock(journal_file, locks.LOCK_EX | locks.LOCK_NB):
+                    # Owned by a running process
+                    journal_file.close()
+                    continue
+                if not os.path.exists(self._entry_path(entry_id, "data")):
+                    # Completed while we were waiting for the lock
+                    journal_file.close()
+                    continue
+                entry = json.load(journal_file)
+            except (OSError, ValueError):
+                if journal_file is not None:
+                    journal_file.close()
+                continue
+
+            if entry["bucket"] != self._bucket_name:
+                journal_file.close()
+                continue
+
+            upload = PendingUpload(
+                entry_id,
+                entry["name"],
+                self._entry_path(entry_id, "data"),
+                entry["content_type"],
+                journal_file,
+                metadata=entry.get("metadata")
+            )
+            with self._lock:
+                current = self._pending.get(upload.name)
+                if current is not None and current.entry_id > entry_id:
+                    # Superseded by a newer upload of this process
+                    self._remove_entry(upload)
+                    upload.done.set()
+                    continue
+                self._pending[upload.name] = upload
+
+            logger.info("Resuming journaled upload of %s", upload.name)
+            self._queue.put(upload)
+
+    def _remove_entry(self, upload):
+        # Keep the lock until the files are gone, other processes would recover the entry otherwise
+        for path in (self._entry_path(upload.entry_id, "json"), upload.data_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        upload.journal_file.close()
+
+    def _retry(self, upload):
+        with self._changed:
+            if self._pending.get(upload.name) is not upload:
+                # Superseded or cancelled in the meantime
+                self._remove_entry(upload)
+                return
+            upload.error = None
+            upload.done.clear()
+
+        logger.info("Retrying upload of %s", upload.name)
+        self._queue.put(upload)
+
+    def _work(self):
+        while True:
+            upload = self._queue.get()
+
+            with self._changed:
+                # Never upload the same name concurrently, the older upload could finish last
+                self._changed.wait_for(lambda: upload.name not in self._uploading)
+                superseded = self._pending.get(upload.name) is not upload
+                if not superseded:
+                    self._uploading.add(upload.name)
+
+            if not superseded:
+                try:
+                    blob = self._storage.bucket.blob(upload.name)
+                    blob.metadata = upload.metadata
+                    blob.upload_from_filename(upload.data_path, content_type=upload.content_type)
+                    _forget_lookup(self._bucket_name, upload.name)
+                except Exception as e:
+                    # The journal entry is kept until the upload succeeds
+                    logger.exception("Upload of %s failed", upload.name)
+                    upload.error = e
+
+            with self._changed:
+                current = self._pending.get(upload.name) is upload
+                if upload.error is not None and current:
+                    upload.attempts += 1
+                    delay = min(RETRY_INTERVAL * 2 ** (upload.attempts - 1), MAX_RETRY_INTERVAL)
+                    timer = threading.Timer(delay, self._retry, (upload,))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    # Errors of superseded uploads don't matter anymore
+                    upload.error = None
+                    self._remove_entry(upload)
+                    if current:
+                        del self._pending[upload.name]
+                self._uploading.discard(upload.name)
+                upload.done.set()
+                self._changed.notify_all()
+
+            self._queue.task_done()
+
+    def get_pending(self, name):
+        """
+        :rtype: PendingUpload
+        """
+        with self._lock:
+            return self._pending.get(name)
+
+    def cancel(self, name):
+        """
+        Drops the pending upload of name, e.g. because the file is deleted.
+        Waits for an upload of name that is already in progress.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: name not in self._uploading)
+            upload = self._pending.pop(name, None)
+            if upload is not None:
+                self._remove_entry(upload)
+                upload.done.set()
+                self._changed.notify_all()
+
+    def wait(self, name, timeout=None):
+        """
+        Waits until all submitted uploads of name finished. Returns False on
+        timeout and re-raises the error if the last attempt failed, the upload
+        is retried in the background.
+        """
+        upload = self.get_pending(name)
+        while upload is not None:
+            if not upload.done.wait(timeout):
+                return False
+            if upload.error is not None:
+                raise upload.error
+            upload = self.get_pending(name)
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Waits until all submitted uploads finished. Returns False on timeout and
+        re-raises the error of an upload whose last attempt failed.
+        """
+        with self._changed:
+            if not self._changed.wait_for(
+                lambda: all(upload.done.is_set() for upload in self._pending.values()),
+                timeout
+            ):
+                return False
+
+            for upload in self._pending.values():
+                if upload.error is not None:
+                    raise upload.error
+
+        return True
+
+
+def _reset_uploaders():
+    # The threads of inherited uploaders don't exist in a forked child, e.g. the
+    # workers of gunicorn --preload. The parent keeps its journal entries locked
+    # through its own file descriptors.
+    global _uploaders, _uploaders_lock
+    inherited = _uploaders
+    _uploaders = {}
+    _uploaders_lock = threading.Lock()
+
+    for uploader in inherited.values():
+        for upload in list(uploader._pending.values()):
+            upload.journal_file.close()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_uploaders)
@@ -37,10 +37,12 @@ setup(
     url='https://github.com/strayer/django-gcloud-storage',
     packages=[
         'django_gcloud_storage',
+        'django_gcloud_storage.management',
+        'django_gcloud_storage.management.commands',
     ],
     include_package_data=True,
     install_requires=[
-        "google-cloud-storage>=1.10.0",
+        "google-cloud-storage>=1.38.0",
         "django>=2.2"
     ],
     license="BSD",
@@ -24,4 +24,5 @@ urlpatterns = [
         TemplateView.as_view(template_name="success.html"),
         name='upload_success'),
     re_path(r'^file/(?P<id>[0-9]+)$', views.file),
+    re_path(r'^file/(?P<id>[0-9]+)/stream$', views.stream_file),
 ]
@@ -2,6 +2,8 @@ from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.generic.edit import FormView
 
+from django_gcloud_storage.views import serve
+
 from test_app.app.forms import TestUploadForm
 from test_app.app.models import ModelWithFileField
 
@@ -23,3 +25,9 @@ def file(request, id):
     testmodel = get_object_or_404(ModelWithFileField, pk=id)
 
     return HttpResponse(testmodel.file, content_type='text/plain')
+
+
+def stream_file(request, id):
+    testmodel = get_object_or_404(ModelWithFileField, pk=id)
+
+    return serve(request, testmodel.file.name, storage=testmodel.file.storage)
@@ -1,4 +1,5 @@
 # coding=utf-8
+import json
 import os
 import string
 
@@ -48,6 +49,41 @@ def storage(request):
 
     storage.bucket.delete(force=True)
 
+@pytest.fixture
+def offline_storage(tmp_path):
+    """
+    Storage instance for tests that don't need to talk to GCS
+    """
+    credentials_file = tmp_path / "credentials.json"
+    credentials_file.write_text("{}")
+
+    return DjangoGCloudStorage(
+        project="offline-project",
+        bucket="offline-bucket",
+        credentials_file_path=str(credentials_file)
+    )
+
+@pytest.fixture
+def service_account_file(tmp_path):
+    pytest.importorskip("cryptography")
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path / "service-account.json"
+    path.write_text(json.dumps({
+        "type": "service_account",
+        "project_id": "offline-project",
+        "client_email": "storage@offline-project.iam.gserviceaccount.com",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "private_key": key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ).decode("ascii"),
+    }))
+    return str(path)
+
 @pytest.fixture(scope="module")
 def test_file(storage):
     path = upload_test_file(storage, TEST_FILE_PATH, TEST_FILE_CONTENT)
@@ -1,3 +1,5 @@
+import datetime
+import io
 from tempfile import TemporaryFile
 
 import sys
@@ -10,3 +12,120 @@ def upload_test_file(storage, name, content):
         testfile.write(content)
         testfile.seek(0)
         return storage.save(name, testfile)
+
+
+class FakeBlob(object):
+    """
+    Minimal in-memory stand-in for google.cloud.storage.blob.Blob
+    """
+    generation = 1
+    md5_hash = None
+    updated = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.metadata = bucket.metadata.get(name)
+        self._properties = {"name": name}
+        self._changes = set()
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, "rb") as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, rewind=False, **kwargs):
+        self.bucket.before_upload(self.name)
+        if rewind:
+            file_obj.seek(0)
+        self.bucket.objects[self.name] = file_obj.read()
+        self.bucket.metadata[self.name] = self.metadata
+        self.bucket.uploads += 1
+        self.content_type = content_type
+
+    def create_resumable_upload_session(self, content_type=None, size=None, origin=None, if_generation_match=None):
+        return "https://storage.googleapis.com/upload/session/" + self.name
+
+    def open(self, mode, content_type=None, chunk_size=None):
+        assert mode == "wb"
+        return FakeBlobWriter(self, content_type)
+
+    def download_to_file(self, file_obj):
+        file_obj.write(self.bucket.objects[self.name])
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        content = self.bucket.objects[self.name]
+        return content[start or 0:None if end is None else end + 1]
+
+
+class FakeBlobWriter(object):
+    def __init__(self, blob, content_type):
+        self.blob = blob
+        self.content_type = content_type
+        self.written = []
+        self.terminated = False
+
+    def write(self, data):
+        self.written.append(data)
+        return len(data)
+
+    def close(self):
+        self.blob.upload_from_file(io.BytesIO(b"".join(self.written)), content_type=self.content_type)
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeBucket(object):
+    def __init__(self, name="offline-bucket"):
+        self.name = name
+        self.objects = {}
+        self.metadata = {}
+        self.uploads = 0
+
+    def before_upload(self, name):
+        pass
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def delete_blob(self, name):
+        if name not in self.objects:
+            from google.cloud.exceptions import NotFound
+            raise NotFound("Object not found")
+        del self.objects[name]
+
+    def copy_blob(self, blob, destination_bucket, new_name, if_generation_match=None):
+        if if_generation_match == 0 and new_name in destination_bucket.objects:
+            from google.cloud.exceptions import PreconditionFailed
+            raise PreconditionFailed("Object exists")
+        destination_bucket.objects[new_name] = self.objects[blob.name]
+        destination_bucket.metadata[new_name] = self.metadata.get(blob.name)
+
+    def list_blobs(self, prefix, delimiter):
+        return FakeIterator(self, prefix, delimiter)
+
+
+class FakeIterator(object):
+    def __init__(self, bucket, prefix, delimiter):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self.prefixes = set()
+
+    def __iter__(self):
+        for name in sorted(self.bucket.objects):
+            if not name.startswith(self.prefix):
+                continue
+            rest = name[len(self.prefix):]
+            if self.delimiter in rest:
+                self.prefixes.add(self.prefix + rest.split(self.delimiter)[0] + self.delimiter)
+            else:
+                yield FakeBlob(self.bucket, name)
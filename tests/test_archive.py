@@ -0,0 +1,59 @@
+# coding=utf-8
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from helpers import FakeBucket
+
+
+@pytest.fixture
+def archive_storage(offline_storage):
+    offline_storage._bucket = FakeBucket()
+    offline_storage._bucket.objects = {
+        "a.txt": b"a" * 10,
+        "dir/b.bin": bytes(range(256)) * 5,
+        "empty": b"",
+    }
+    return offline_storage
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestStreamArchive:
+    NAMES = ["a.txt", "dir/b.bin", "empty"]
+
+    def test_should_stream_zip_archives(self, archive_storage):
+        chunks = list(archive_storage.stream_archive(self.NAMES, chunk_size=100, concurrency=2))
+
+        assert len(chunks) > len(self.NAMES)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            assert archive.namelist() == self.NAMES
+            for name in self.NAMES:
+                assert archive.read(name) == archive_storage._bucket.objects[name]
+
+    def test_should_stream_compressed_zip_archives(self, archive_storage):
+        data = b"".join(archive_storage.stream_archive(self.NAMES, compression=zipfile.ZIP_DEFLATED))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.read("dir/b.bin") == archive_storage._bucket.objects["dir/b.bin"]
+
+    def test_should_stream_tar_archives(self, archive_storage):
+        data = b"".join(archive_storage.stream_archive(self.NAMES, archive_format="tar", chunk_size=100))
+
+        assert len(data) % tarfile.RECORDSIZE == 0
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            assert archive.getnames() == self.NAMES
+            for name in self.NAMES:
+                assert archive.extractfile(name).read() == archive_storage._bucket.objects[name]
+
+    def test_should_raise_for_missing_files(self, archive_storage):
+        with pytest.raises(FileNotFoundError):
+            b"".join(archive_storage.stream_archive(["a.txt", "missing"]))
+
+    def test_should_stop_when_closed_early(self, archive_storage):
+        archive_storage._bucket.objects.update(("file%d" % i, b"x" * 1000) for i in range(20))
+        chunks = archive_storage.stream_archive(["file%d" % i for i in range(20)], chunk_size=10)
+
+        next(chunks)
+        chunks.close()
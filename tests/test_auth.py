@@ -0,0 +1,104 @@
+# coding=utf-8
+import datetime
+import os
+
+import pytest
+
+from django_gcloud_storage import DjangoGCloudStorage
+from django_gcloud_storage import auth
+from django_gcloud_storage.auth import TokenRefresher, get_credentials, _utcnow
+
+
+class FakeCredentials(object):
+    def __init__(self, expires_in=None):
+        self.token = "token" if expires_in is not None else None
+        self.expiry = _utcnow() + datetime.timedelta(seconds=expires_in) if expires_in is not None else None
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        return self.token is not None and self.expiry > _utcnow()
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = "token"
+        self.expiry = _utcnow() + datetime.timedelta(hours=1)
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestTokenRefresher:
+    def test_should_fetch_missing_tokens(self):
+        credentials = FakeCredentials()
+
+        timeout = TokenRefresher(credentials, margin=300).refresh_if_needed()
+
+        assert credentials.refreshes == 1
+        assert 3290 < timeout <= 3300
+
+    def test_should_not_refresh_fresh_tokens(self):
+        credentials = FakeCredentials(expires_in=600)
+
+        timeout = TokenRefresher(credentials, margin=300).refresh_if_needed()
+
+        assert credentials.refreshes == 0
+        assert 290 < timeout <= 300
+
+    def test_should_refresh_tokens_ahead_of_expiry(self):
+        credentials = FakeCredentials(expires_in=200)
+
+        TokenRefresher(credentials, margin=300).refresh_if_needed()
+
+        assert credentials.refreshes == 1
+
+    def test_should_restart_refreshers_in_forked_processes(self, monkeypatch):
+        credentials = FakeCredentials(expires_in=3600)
+        inherited = TokenRefresher(credentials, margin=300)
+        monkeypatch.setattr(auth, "_refreshers", {"credentials.json": inherited})
+
+        auth._restart_refreshers()
+
+        refresher = auth._refreshers["credentials.json"]
+        try:
+            assert refresher is not inherited
+            assert refresher.is_alive()
+            assert refresher.credentials is credentials
+            assert refresher.margin == inherited.margin
+        finally:
+            refresher.stop()
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires fork()")
+    def test_forked_processes_should_run_refreshers(self, monkeypatch):
+        refresher = TokenRefresher(FakeCredentials(expires_in=3600), margin=300)
+        refresher.start()
+        monkeypatch.setattr(auth, "_refreshers", {"credentials.json": refresher})
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if auth._refreshers["credentials.json"].is_alive() else 1)
+        refresher.stop()
+
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestSharedCredentials:
+    def test_should_share_credentials_between_storages(self, service_account_file):
+        storages = [
+            DjangoGCloudStorage(project="offline-project", bucket=bucket, credentials_file_path=service_account_file)
+            for bucket in ["bucket-a", "bucket-b"]
+        ]
+
+        assert storages[0].credentials is storages[1].credentials
+        assert storages[0].credentials is get_credentials(service_account_file)
+        assert storages[0].client._credentials is storages[1].client._credentials
+
+    def test_warm_up_should_fetch_token_and_bucket(self, offline_storage):
+        offline_storage._credentials = FakeCredentials()
+        offline_storage._bucket = object()
+
+        assert offline_storage.warm_up() is offline_storage._bucket
+        assert offline_storage._credentials.refreshes == 1
+
+        offline_storage.warm_up()
+        assert offline_storage._credentials.refreshes == 1
@@ -1,16 +1,30 @@
 # coding=utf-8
+import asyncio
+import base64
 import datetime
+import hashlib
+import hmac
+import io
 import ssl
 import sys
+import threading
 
 import google.cloud.exceptions
 import pytest
+from google.cloud.storage import Bucket
 from django.core.exceptions import SuspiciousFileOperation
 
-from django_gcloud_storage import safe_join, remove_prefix, GCloudFile
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+
+from django_gcloud_storage import (
+    DjangoGCloudStorage, safe_join, remove_prefix, GCloudFile, iter_blob_chunks, sign_cdn_url, sign_cdn_cookie, CDN_COOKIE_NAME,
+    content_address, SingleFlight, NamingStrategy, HashPrefixNamingStrategy, ReversedNamingStrategy, _copy_blob,
+    _single_flight
+)
 
 from conftest import TEST_FILE_CONTENT, TEST_FILE_PATH
-from helpers import upload_test_file
+from helpers import upload_test_file, FakeBucket
 
 def urlopen(*args, **kwargs):
     try:
@@ -72,6 +86,531 @@ def test_remove_prefix_function():
     assert remove_prefix("/a/b/c/", "/b/") == "/a/b/c/"
 
 
+def test_iter_blob_chunks_function():
+    class FakeBlob(object):
+        size = 10
+        generation = 1
+        content = b"0123456789"
+
+        def download_as_bytes(self, start, end, if_generation_match):
+            assert if_generation_match == self.generation
+            return self.content[start:end + 1]
+
+    blob = FakeBlob()
+
+    assert list(iter_blob_chunks(blob, chunk_size=4)) == [b"0123", b"4567", b"89"]
+    assert list(iter_blob_chunks(blob, 3, 6, chunk_size=2)) == [b"34", b"56"]
+    assert b"".join(iter_blob_chunks(blob)) == blob.content
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestNamingStrategies:
+    NAMES = ["uploads/12345.jpg", "noext", "a/b/c.tar.gz", "brathähnchen.txt"]
+
+    def test_default_strategy_should_keep_names(self):
+        for name in self.NAMES:
+            assert NamingStrategy().to_key(name) == name
+
+    def test_hash_prefix_strategy(self):
+        strategy = HashPrefixNamingStrategy(length=3)
+
+        assert strategy.to_key("uploads/1.jpg") != strategy.to_key("uploads/2.jpg")
+        for name in self.NAMES:
+            key = strategy.to_key(name)
+            assert len(key.split("/")[0]) == 3
+            assert key.endswith("/" + name)
+            assert strategy.from_key(key) == name
+
+    def test_reversed_strategy(self):
+        strategy = ReversedNamingStrategy()
+
+        assert strategy.to_key("uploads/12345.jpg") == "uploads/54321.jpg"
+        for name in self.NAMES:
+            assert strategy.from_key(strategy.to_key(name)) == name
+
+    def test_storage_should_resolve_logical_names(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.naming_strategy = HashPrefixNamingStrategy()
+
+        name = offline_storage.save("uploads/1.txt", ContentFile(b"content"))
+        key = HashPrefixNamingStrategy().to_key("uploads/1.txt")
+
+        assert name == "uploads/1.txt"
+        assert list(offline_storage._bucket.objects) == [key]
+        assert offline_storage.exists(name)
+        assert offline_storage.open(name).read() == b"content"
+
+        offline_storage.use_unsigned_urls = True
+        assert offline_storage.url(name).endswith("/" + key)
+
+        with pytest.raises(NotImplementedError):
+            offline_storage.listdir("uploads")
+
+        offline_storage.delete(name)
+        assert offline_storage._bucket.objects == {}
+
+    def test_storage_should_list_reversed_names(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.naming_strategy = ReversedNamingStrategy()
+
+        offline_storage.save("uploads/123.txt", ContentFile(b""))
+        offline_storage.save("uploads/sub/4.txt", ContentFile(b""))
+
+        assert "uploads/321.txt" in offline_storage._bucket.objects
+        assert offline_storage.listdir("uploads/") == (["sub"], ["123.txt"])
+
+    def test_storage_should_load_strategies_from_settings(self, offline_storage, settings):
+        settings.GCS_NAMING_STRATEGY = "django_gcloud_storage.ReversedNamingStrategy"
+
+        storage = DjangoGCloudStorage(
+            project="offline-project",
+            bucket="offline-bucket",
+            credentials_file_path=offline_storage.credentials_file_path
+        )
+
+        assert isinstance(storage.naming_strategy, ReversedNamingStrategy)
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestSingleFlight:
+    def run_concurrently(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_should_share_results_of_concurrent_calls(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            assert release.wait(5)
+            return "result"
+
+        threads = self.run_concurrently(lambda: results.append(single_flight.do("key", fn)), 5)
+        while single_flight._calls.get("key") is None or single_flight._calls["key"].followers < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert results == ["result"] * 5
+
+    def test_should_not_share_results_of_sequential_calls(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        single_flight.do("key", lambda: calls.append(1))
+        single_flight.do("key", lambda: calls.append(1))
+
+        assert calls == [1, 1]
+
+    def test_should_share_exceptions(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fn():
+            assert release.wait(5)
+            raise IOError("Request failed")
+
+        def target():
+            try:
+                single_flight.do("key", fn)
+            except IOError as e:
+                errors.append(e)
+
+        threads = self.run_concurrently(target, 3)
+        while single_flight._calls.get("key") is None or single_flight._calls["key"].followers < 2:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(errors) == 3
+        assert "key" not in single_flight._calls
+
+    def test_should_pass_shared_results_to_followers(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        results = []
+
+        def fn():
+            assert release.wait(5)
+            return "own"
+
+        threads = self.run_concurrently(lambda: results.append(single_flight.do("key", fn, share=str.upper)), 2)
+        while single_flight._calls.get("key") is None or single_flight._calls["key"].followers < 1:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == ["OWN", "own"]
+
+    def test_should_coalesce_coroutines(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            assert release.wait(5)
+            return "result"
+
+        async def main():
+            tasks = [asyncio.ensure_future(single_flight.ado("key", fn)) for _ in range(5)]
+            while single_flight._calls.get("key") is None or single_flight._calls["key"].followers < 4:
+                await asyncio.sleep(0.01)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        assert asyncio.run(main()) == ["result"] * 5
+        assert calls == [1]
+
+    def test_should_start_new_calls_after_forget(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        results = []
+
+        def fn():
+            assert release.wait(5)
+            return "old"
+
+        threads = self.run_concurrently(lambda: results.append(single_flight.do("key", fn)), 1)
+        while single_flight._calls.get("key") is None:
+            threading.Event().wait(0.01)
+
+        single_flight.forget("key")
+
+        assert single_flight.do("key", lambda: "new") == "new"
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == ["old"]
+        assert "key" not in single_flight._calls
+
+    def test_cancelled_coroutines_should_not_cancel_shared_calls(self, offline_storage):
+        release = threading.Event()
+
+        class SlowBucket(FakeBucket):
+            def get_blob(self, name):
+                assert release.wait(5)
+                return super(SlowBucket, self).get_blob(name)
+
+        offline_storage._bucket = SlowBucket()
+        offline_storage._bucket.objects["hot.txt"] = b"hot"
+        key = ("get_blob", offline_storage.bucket_name, "hot.txt")
+        blobs = []
+        errors = []
+
+        def get_blob():
+            try:
+                blobs.append(offline_storage.get_blob("hot.txt"))
+            except Exception as e:
+                errors.append(e)
+
+        leader = self.run_concurrently(get_blob, 1)
+        while _single_flight._calls.get(key) is None:
+            threading.Event().wait(0.01)
+
+        async def cancel_follower():
+            task = asyncio.ensure_future(offline_storage.aget_blob("hot.txt"))
+            while _single_flight._calls[key].followers < 1:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_follower())
+        follower = self.run_concurrently(get_blob, 1)
+        while _single_flight._calls[key].followers < 2:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in leader + follower:
+            thread.join()
+
+        assert errors == []
+        assert [blob.name for blob in blobs] == ["hot.txt", "hot.txt"]
+
+    def test_storage_should_read_own_writes(self, offline_storage):
+        release = threading.Event()
+
+        class SlowBucket(FakeBucket):
+            lookups = 0
+
+            def get_blob(self, name):
+                self.lookups += 1
+                if self.lookups == 1:
+                    # Lookup started before the file was written
+                    assert release.wait(5)
+                    return None
+                return super(SlowBucket, self).get_blob(name)
+
+        offline_storage._bucket = SlowBucket()
+        key = ("get_blob", offline_storage.bucket_name, "new.txt")
+        results = []
+
+        threads = self.run_concurrently(lambda: results.append(offline_storage.exists("new.txt")), 1)
+        while _single_flight._calls.get(key) is None:
+            threading.Event().wait(0.01)
+        # Don't hang if the stale lookup is joined
+        threading.Timer(1, release.set).start()
+
+        f = GCloudFile(offline_storage._bucket.blob("new.txt"))
+        f.write(b"new")
+        f.close()
+
+        assert offline_storage.exists("new.txt")
+        assert offline_storage.size("new.txt") == 3
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == [False]
+
+    def test_storage_should_coalesce_downloads(self, offline_storage):
+        release = threading.Event()
+
+        class SlowBucket(FakeBucket):
+            downloads = 0
+
+            def get_blob(self, name):
+                blob = super(SlowBucket, self).get_blob(name)
+                download_to_file = blob.download_to_file
+
+                def slow_download_to_file(file_obj):
+                    self.downloads += 1
+                    assert release.wait(5)
+                    download_to_file(file_obj)
+
+                blob.download_to_file = slow_download_to_file
+                return blob
+
+        offline_storage._bucket = SlowBucket()
+        offline_storage._bucket.objects["hot.txt"] = b"hot"
+        contents = []
+
+        threads = self.run_concurrently(lambda: contents.append(offline_storage.open("hot.txt").read()), 4)
+        threading.Event().wait(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert contents == [b"hot"] * 4
+        assert 1 <= offline_storage._bucket.downloads < 4
+
+    def test_storage_should_not_share_blobs(self, offline_storage):
+        release = threading.Event()
+
+        class SlowBucket(FakeBucket):
+            lookups = 0
+
+            def get_blob(self, name):
+                self.lookups += 1
+                assert release.wait(5)
+                return super(SlowBucket, self).get_blob(name)
+
+        offline_storage._bucket = SlowBucket()
+        offline_storage._bucket.objects["hot.txt"] = b"hot"
+        blobs = []
+
+        threads = self.run_concurrently(lambda: blobs.append(offline_storage.get_blob("hot.txt")), 4)
+        threading.Event().wait(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert offline_storage._bucket.lookups < 4
+        assert len(set(map(id, blobs))) == 4
+        assert len(set(id(blob._properties) for blob in blobs)) == 4
+
+    def test_copied_blobs_should_be_independent(self):
+        blob = Bucket(client=None, name="bucket").blob("a.txt")
+        blob.metadata = {"a": "1"}
+
+        copied = _copy_blob(blob)
+        copied.metadata = {"b": "2"}
+
+        assert blob.metadata == {"a": "1"}
+        assert blob._changes == {"metadata"}
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestContentAddressed:
+    CONTENT = "Brathähnchen".encode("utf8")
+
+    def test_content_address_function(self):
+        digest = hashlib.sha256(self.CONTENT).hexdigest()
+
+        assert content_address("avatars/Me.JPG", ContentFile(self.CONTENT)) == "avatars/%s.jpg" % digest
+        assert content_address("noext", ContentFile(self.CONTENT)) == digest
+
+    def test_should_deduplicate_saves(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.content_addressed = True
+
+        first = offline_storage.save("avatars/me.png", ContentFile(self.CONTENT))
+        second = offline_storage.save("avatars/other.png", ContentFile(self.CONTENT))
+
+        assert first == second
+        assert first.startswith("avatars/") and first.endswith(".png")
+        assert offline_storage._bucket.uploads == 1
+        assert offline_storage.original_name(first) == "me.png"
+
+    def test_should_not_delete_shared_objects(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.content_addressed = True
+
+        name = offline_storage.save("avatars/me.png", ContentFile(self.CONTENT))
+        offline_storage.delete(name)
+
+        assert offline_storage.exists(name)
+
+        offline_storage.purge(name)
+
+        assert not offline_storage.exists(name)
+
+    def test_should_not_change_shared_objects(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.content_addressed = True
+        name = offline_storage.save("avatars/me.png", ContentFile(self.CONTENT))
+
+        with offline_storage.open(name, "wb") as f:
+            with pytest.raises(io.UnsupportedOperation):
+                f.write(b"changed")
+
+        assert offline_storage._bucket.objects[name] == self.CONTENT
+
+    def test_should_check_max_length(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.content_addressed = True
+
+        assert offline_storage.get_available_name("avatars/me.png", max_length=100) == "avatars/me.png"
+        with pytest.raises(SuspiciousFileOperation):
+            offline_storage.get_available_name("avatars/me.png", max_length=64)
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestSaveStream:
+    def test_should_save_iterables(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+
+        name = offline_storage.save_stream("exports/data.csv", (row for row in ["a,b\n", b"1,2\n"]))
+
+        assert name == "exports/data.csv"
+        assert offline_storage._bucket.objects[name] == b"a,b\n1,2\n"
+
+    def test_should_not_overwrite_existing_files(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+
+        first = offline_storage.save_stream("exports/data.csv", [b"1"])
+        second = offline_storage.save_stream("exports/data.csv", [b"2"])
+
+        assert first != second
+        assert offline_storage._bucket.objects[first] == b"1"
+
+    def test_should_not_finalize_failed_streams(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+
+        def failing():
+            yield b"partial"
+            raise ValueError("Export failed")
+
+        with pytest.raises(ValueError):
+            offline_storage.save_stream("exports/data.csv", failing())
+
+        assert offline_storage._bucket.objects == {}
+
+    def test_should_deduplicate_content_addressed_streams(self, offline_storage):
+        offline_storage._bucket = FakeBucket()
+        offline_storage.content_addressed = True
+        digest = hashlib.sha256(b"content").hexdigest()
+
+        first = offline_storage.save_stream("exports/a.csv", [b"con", b"tent"])
+        second = offline_storage.save_stream("exports/b.csv", [b"content"])
+
+        assert first == second == "exports/%s.csv" % digest
+        assert list(offline_storage._bucket.objects) == [first]
+        assert offline_storage.original_name(first) == "a.csv"
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestCloudCDNSigning:
+    KEY = base64.urlsafe_b64encode(b"0123456789abcdef").decode("ascii")
+    EXPIRATION = datetime.datetime.fromtimestamp(1700000000)
+
+    def signature(self, value):
+        digest = hmac.new(b"0123456789abcdef", value.encode("utf-8"), hashlib.sha1).digest()
+        return base64.urlsafe_b64encode(digest).decode("ascii")
+
+    def test_should_sign_urls(self):
+        url = sign_cdn_url("https://cdn.example.com/a.jpg", "my-key", self.KEY, self.EXPIRATION)
+        signed_part = "https://cdn.example.com/a.jpg?Expires=1700000000&KeyName=my-key"
+
+        assert url == signed_part + "&Signature=" + self.signature(signed_part)
+
+    def test_should_append_to_existing_query_strings(self):
+        url = sign_cdn_url("https://cdn.example.com/a.jpg?w=100", "my-key", self.KEY, self.EXPIRATION)
+
+        assert url.startswith("https://cdn.example.com/a.jpg?w=100&Expires=1700000000&KeyName=my-key&Signature=")
+
+    def test_should_sign_cookie_policies(self):
+        value = sign_cdn_cookie("https://cdn.example.com/gallery/", "my-key", self.KEY, self.EXPIRATION)
+        policy = "URLPrefix={}:Expires=1700000000:KeyName=my-key".format(
+            base64.urlsafe_b64encode(b"https://cdn.example.com/gallery/").decode("ascii")
+        )
+
+        assert value == policy + ":Signature=" + self.signature(policy)
+
+    def test_storage_should_build_cdn_urls(self, offline_storage):
+        offline_storage.cdn_base_url = "https://cdn.example.com/"
+
+        assert offline_storage.url("dir/a b.jpg") == "https://cdn.example.com/dir/a%20b.jpg"
+
+        offline_storage.cdn_key_name = "my-key"
+        offline_storage.cdn_key = self.KEY
+        url = offline_storage.url("dir/a b.jpg")
+
+        assert url.startswith("https://cdn.example.com/dir/a%20b.jpg?Expires=")
+        assert "&KeyName=my-key&Signature=" in url
+
+    def test_storage_should_set_unquoted_signed_cookies(self, offline_storage):
+        offline_storage.cdn_base_url = "https://cdn.example.com"
+        offline_storage.cdn_key_name = "my-key"
+        offline_storage.cdn_key = self.KEY
+        response = HttpResponse()
+
+        offline_storage.set_cdn_signed_cookie(response, "gallery/", expiration=self.EXPIRATION)
+
+        header = response.cookies[CDN_COOKIE_NAME].OutputString()
+        assert header.startswith(CDN_COOKIE_NAME + "=" + sign_cdn_cookie(
+            "https://cdn.example.com/gallery/", "my-key", self.KEY, self.EXPIRATION
+        ) + ";")
+
+    def test_storage_should_sign_cookies_for_directories_only(self, offline_storage):
+        offline_storage.cdn_base_url = "https://cdn.example.com"
+        offline_storage.cdn_key_name = "my-key"
+        offline_storage.cdn_key = self.KEY
+
+        assert offline_storage.cdn_signed_cookie("gallery/42", expiration=self.EXPIRATION) == sign_cdn_cookie(
+            "https://cdn.example.com/gallery/42/", "my-key", self.KEY, self.EXPIRATION
+        )
+
+    def test_storage_should_require_cdn_key_names(self, offline_storage):
+        with pytest.raises(AssertionError):
+            DjangoGCloudStorage(
+                project=offline_storage.project_name,
+                bucket=offline_storage.bucket_name,
+                credentials_file_path=offline_storage.credentials_file_path,
+                cdn_base_url="https://cdn.example.com",
+                cdn_key=self.KEY
+            )
+
+
 # noinspection PyMethodMayBeStatic,PyTypeChecker
 class TestGCloudFile:
     TEST_CONTENT = "Brathähnchen".encode("utf8")
@@ -0,0 +1,154 @@
+# coding=utf-8
+import base64
+import json
+
+import pytest
+from django.core import signing
+from django.core.exceptions import SuspiciousOperation
+from django.forms import Form
+from django.test import RequestFactory
+
+from django_gcloud_storage import DIRECT_UPLOAD_SALT
+from django_gcloud_storage.forms import DirectUploadField
+from django_gcloud_storage.views import DirectUploadPolicyView
+
+from helpers import FakeBucket
+
+
+@pytest.fixture
+def upload_storage(offline_storage):
+    offline_storage._bucket = FakeBucket()
+    return offline_storage
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestDirectUpload:
+    def test_should_create_upload_sessions(self, upload_storage):
+        session = upload_storage.create_upload_session("uploads/a.txt", content_type="text/plain", size=7)
+        name = session["name"]
+
+        assert name.startswith("uploads/a_") and name.endswith(".txt")
+        assert session["url"].endswith("/" + name)
+
+        upload_storage._bucket.objects[name] = b"content"
+        assert upload_storage.finalize_direct_upload(session["token"]) == name
+
+    def test_should_use_unique_names_for_concurrent_uploads(self, upload_storage):
+        first = upload_storage.create_upload_session("uploads/a.txt")
+        second = upload_storage.create_upload_session("uploads/a.txt")
+
+        assert first["name"] != second["name"]
+
+    def test_should_generate_signed_post_policies(self, upload_storage, service_account_file):
+        from django_gcloud_storage.auth import get_credentials
+        upload_storage._credentials = get_credentials(service_account_file)
+
+        policy = upload_storage.generate_upload_policy("uploads/a.txt", content_type="text/plain", max_size=100)
+
+        assert policy["url"].startswith("https://")
+        assert policy["fields"]["key"] == policy["name"]
+        assert policy["name"].startswith("uploads/a_")
+        assert policy["fields"]["Content-Type"] == "text/plain"
+        assert "x-goog-signature" in policy["fields"]
+
+        conditions = json.loads(base64.b64decode(policy["fields"]["policy"]))["conditions"]
+        assert ["content-length-range", 0, 100] in conditions
+
+    def test_should_reject_content_addressed_storages(self, upload_storage):
+        upload_storage.content_addressed = True
+
+        with pytest.raises(NotImplementedError):
+            upload_storage.create_upload_session("uploads/a.txt")
+
+    def test_finalize_should_delete_too_large_content_addressed_files(self, upload_storage):
+        upload_storage.content_addressed = True
+        token = signing.dumps({"name": "uploads/a.txt", "max_size": 3}, salt=DIRECT_UPLOAD_SALT)
+        upload_storage._bucket.objects["uploads/a.txt"] = b"content"
+
+        with pytest.raises(ValueError):
+            upload_storage.finalize_direct_upload(token)
+
+        assert upload_storage._bucket.objects == {}
+
+    def test_finalize_should_reject_invalid_tokens(self, upload_storage):
+        forged = signing.dumps({"name": "other/file.txt", "max_size": None}, salt="other")
+
+        with pytest.raises(SuspiciousOperation):
+            upload_storage.finalize_direct_upload(forged)
+
+    def test_finalize_should_require_uploaded_files(self, upload_storage):
+        session = upload_storage.create_upload_session("uploads/a.txt")
+
+        with pytest.raises(FileNotFoundError):
+            upload_storage.finalize_direct_upload(session["token"])
+
+    def test_finalize_should_delete_too_large_files(self, upload_storage):
+        token = signing.dumps({"name": "uploads/a.txt", "max_size": 3}, salt=DIRECT_UPLOAD_SALT)
+        upload_storage._bucket.objects["uploads/a.txt"] = b"content"
+
+        with pytest.raises(ValueError):
+            upload_storage.finalize_direct_upload(token)
+
+        assert upload_storage._bucket.objects == {}
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestDirectUploadField:
+    def form(self, storage, data=None):
+        class UploadForm(Form):
+            file = DirectUploadField(policy_url="/upload-policy", storage=storage)
+
+        return UploadForm(data)
+
+    def test_should_render_upload_input(self, upload_storage):
+        html = str(self.form(upload_storage)["file"])
+
+        assert 'type="file"' in html
+        assert 'data-direct-upload-policy-url="/upload-policy"' in html
+        assert 'data-direct-upload-target="id_file"' in html
+        assert 'type="hidden"' in html
+
+    def test_should_clean_tokens_to_names(self, upload_storage):
+        session = upload_storage.create_upload_session("uploads/a.txt")
+        upload_storage._bucket.objects[session["name"]] = b"content"
+
+        form = self.form(upload_storage, {"file": session["token"]})
+
+        assert form.is_valid()
+        assert form.cleaned_data["file"] == session["name"]
+
+    def test_should_reject_invalid_uploads(self, upload_storage):
+        session = upload_storage.create_upload_session("uploads/a.txt")
+
+        form = self.form(upload_storage, {"file": session["token"]})
+        assert not form.is_valid()
+        assert form.errors["file"][0].startswith("The file has not been uploaded")
+
+        form = self.form(upload_storage, {"file": "forged"})
+        assert not form.is_valid()
+        assert form.errors["file"][0].startswith("The upload is invalid")
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestDirectUploadPolicyView:
+    def test_should_return_policies(self, upload_storage, monkeypatch):
+        def generate_upload_policy(name, content_type=None, max_size=None):
+            return {"url": "https://storage.googleapis.com/bucket", "fields": {"key": name}, "name": name,
+                    "token": "token"}
+        monkeypatch.setattr(upload_storage, "generate_upload_policy", generate_upload_policy)
+        view = DirectUploadPolicyView.as_view(storage=upload_storage, upload_to="uploads", max_size=10)
+
+        request = RequestFactory().post("/upload-policy", {"name": "../my file.txt", "content_type": "text/plain"})
+        response = view(request)
+
+        assert response.status_code == 200
+        assert json.loads(response.content.decode("utf8")) == {
+            "url": "https://storage.googleapis.com/bucket",
+            "fields": {"key": "uploads/my_file.txt"},
+            "token": "token",
+        }
+
+    def test_should_require_file_names(self, upload_storage):
+        view = DirectUploadPolicyView.as_view(storage=upload_storage)
+
+        assert view(RequestFactory().post("/upload-policy", {})).status_code == 400
@@ -0,0 +1,165 @@
+# coding=utf-8
+import json
+import threading
+
+import pytest
+from django.core.management import call_command, CommandError
+
+from django_gcloud_storage.management.commands.migrate_to_gcs import Command
+from test_app.app.models import ModelWithFileField
+
+from helpers import FakeBucket
+
+
+@pytest.fixture
+def source_root(tmp_path):
+    root = tmp_path / "media"
+    for name in ["a.txt", "dir/b.txt", "dir/sub/c.txt"]:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode("utf8"))
+    return root
+
+
+@pytest.fixture
+def bucket(offline_storage, monkeypatch):
+    offline_storage._bucket = FakeBucket()
+    monkeypatch.setattr(Command, "get_storage", lambda self: offline_storage)
+    return offline_storage._bucket
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestMigrateToGCS:
+    def migrate(self, source_root, tmp_path, **options):
+        call_command(
+            "migrate_to_gcs",
+            source_root=str(source_root),
+            state_file=str(tmp_path / "state.json"),
+            workers=2,
+            **options
+        )
+        with open(str(tmp_path / "state.json")) as f:
+            return json.load(f)
+
+    def test_should_copy_all_files_below_root(self, source_root, tmp_path, bucket):
+        state = self.migrate(source_root, tmp_path, walk=True)
+
+        assert bucket.objects == {
+            "a.txt": b"a.txt",
+            "dir/b.txt": b"dir/b.txt",
+            "dir/sub/c.txt": b"dir/sub/c.txt",
+        }
+        assert state["position"] == "dir/sub/c.txt"
+        assert state["failed"] == []
+
+    def test_should_resume_after_checkpoint(self, source_root, tmp_path, bucket):
+        self.migrate(source_root, tmp_path, walk=True)
+        (source_root / "dir" / "sub" / "d.txt").write_bytes(b"d")
+        uploads = bucket.uploads
+
+        state = self.migrate(source_root, tmp_path, walk=True)
+
+        assert bucket.uploads == uploads + 1
+        assert state["position"] == "dir/sub/d.txt"
+
+    def test_should_resume_after_removed_checkpoint(self, source_root, tmp_path, bucket):
+        self.migrate(source_root, tmp_path, walk=True)
+        (source_root / "dir" / "sub" / "c.txt").unlink()
+        (source_root / "dir" / "sub" / "d.txt").write_bytes(b"d")
+        (source_root / "dir" / "a.txt").write_bytes(b"a")
+        (source_root / "e.txt").write_bytes(b"e")
+        uploads = bucket.uploads
+
+        state = self.migrate(source_root, tmp_path, walk=True)
+
+        # Files before the checkpoint aren't copied again
+        assert "dir/a.txt" not in bucket.objects and "e.txt" not in bucket.objects
+        assert bucket.objects["dir/sub/d.txt"] == b"d"
+        assert bucket.uploads == uploads + 1
+        assert state["position"] == "dir/sub/d.txt"
+
+    def test_should_skip_existing_files(self, source_root, tmp_path, bucket):
+        bucket.objects["a.txt"] = b"a.txt"
+
+        self.migrate(source_root, tmp_path, walk=True)
+
+        assert bucket.uploads == 2
+
+    def test_should_record_and_retry_failed_files(self, source_root, tmp_path, bucket):
+        def fail(name):
+            if name == "a.txt":
+                raise IOError("Upload failed")
+        bucket.before_upload = fail
+
+        state = self.migrate(source_root, tmp_path, walk=True)
+        assert state["failed"] == ["a.txt"]
+        assert state["position"] == "dir/sub/c.txt"
+        assert "a.txt" not in bucket.objects
+
+        del bucket.before_upload
+        state = self.migrate(source_root, tmp_path, walk=True)
+        assert state["failed"] == []
+        assert bucket.objects["a.txt"] == b"a.txt"
+
+    def test_should_keep_unfinished_retries(self, source_root, tmp_path, bucket, monkeypatch):
+        def fail(name):
+            if name == "a.txt":
+                raise IOError("Upload failed")
+        bucket.before_upload = fail
+        self.migrate(source_root, tmp_path, walk=True)
+
+        uploading = threading.Event()
+        checkpointed = threading.Event()
+
+        def slow(name):
+            uploading.set()
+            assert checkpointed.wait(5)
+        bucket.before_upload = slow
+
+        save_state = Command.save_state
+
+        def crash_after_checkpoint(command):
+            if not uploading.wait(5):
+                return save_state(command)
+            save_state(command)
+            checkpointed.set()
+            raise RuntimeError("Crashed")
+        monkeypatch.setattr(Command, "save_state", crash_after_checkpoint)
+
+        with pytest.raises(RuntimeError):
+            self.migrate(source_root, tmp_path, walk=True, report_interval=0)
+
+        with open(str(tmp_path / "state.json")) as f:
+            assert json.load(f)["failed"] == ["a.txt"]
+
+    def test_should_refuse_state_files_of_other_migrations(self, source_root, tmp_path, bucket):
+        self.migrate(source_root, tmp_path, walk=True)
+
+        with pytest.raises(CommandError):
+            self.migrate(source_root, tmp_path)
+
+    @pytest.mark.django_db
+    def test_should_copy_files_referenced_by_models(self, source_root, tmp_path, bucket):
+        ModelWithFileField.objects.create(file="a.txt")
+        last = ModelWithFileField.objects.create(file="dir/b.txt")
+        ModelWithFileField.objects.create(file="")
+
+        state = self.migrate(source_root, tmp_path)
+
+        assert sorted(bucket.objects) == ["a.txt", "dir/b.txt"]
+        assert state["position"] == ["app.ModelWithFileField", "file", str(last.pk)]
+
+    @pytest.mark.django_db
+    def test_should_resume_after_renamed_models(self, source_root, tmp_path, bucket):
+        ModelWithFileField.objects.create(file="a.txt")
+        with open(str(tmp_path / "state.json"), "w") as f:
+            json.dump({
+                "walk": False,
+                "source_root": str(source_root),
+                "position": ["app.AOldName", "file", "1"],
+                "failed": [],
+            }, f)
+
+        self.migrate(source_root, tmp_path)
+
+        assert sorted(bucket.objects) == ["a.txt"]
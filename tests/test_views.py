@@ -0,0 +1,100 @@
+# coding=utf-8
+import tempfile
+
+import pytest
+from django.core.files import File
+from django.utils.crypto import get_random_string
+
+from django_gcloud_storage.views import parse_range_header
+from test_app.app.models import ModelWithFileField
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestParseRangeHeader:
+    def test_should_ignore_missing_or_malformed_headers(self):
+        assert parse_range_header(None, 100) is None
+        assert parse_range_header("", 100) is None
+        assert parse_range_header("bytes=a-b", 100) is None
+        assert parse_range_header("items=0-10", 100) is None
+
+    def test_should_ignore_multiple_ranges(self):
+        assert parse_range_header("bytes=0-1,5-6", 100) is None
+
+    def test_should_parse_closed_ranges(self):
+        assert parse_range_header("bytes=0-9", 100) == (0, 9)
+        assert parse_range_header("bytes=10-10", 100) == (10, 10)
+
+    def test_should_parse_open_ranges(self):
+        assert parse_range_header("bytes=90-", 100) == (90, 99)
+
+    def test_should_parse_suffix_ranges(self):
+        assert parse_range_header("bytes=-10", 100) == (90, 99)
+        assert parse_range_header("bytes=-1000", 100) == (0, 99)
+
+    def test_should_clamp_end_to_size(self):
+        assert parse_range_header("bytes=50-1000", 100) == (50, 99)
+
+    def test_should_raise_on_unsatisfiable_ranges(self):
+        with pytest.raises(ValueError):
+            parse_range_header("bytes=100-", 100)
+        with pytest.raises(ValueError):
+            parse_range_header("bytes=-0", 100)
+
+
+@pytest.mark.usefixtures("gcs_settings")
+class TestServe:
+    TEST_FILE_NAME = "test_stream_file_" + get_random_string(6)
+    TEST_FILE_CONTENT = "Brathähnchen".encode("utf8")
+
+    def create_model_instance(self):
+        model_instance = ModelWithFileField()
+
+        with tempfile.TemporaryFile() as testfile:
+            testfile.write(self.TEST_FILE_CONTENT)
+            testfile.seek(0)
+
+            model_instance.file.save(self.TEST_FILE_NAME, File(testfile))
+
+        model_instance.save()
+        return model_instance
+
+    @pytest.mark.django_db
+    def test_should_stream_whole_file(self, client):
+        model_instance = self.create_model_instance()
+
+        r = client.get('/file/%s/stream' % model_instance.pk)
+
+        assert 200 == r.status_code
+        assert r.streaming
+        assert b"".join(r.streaming_content) == self.TEST_FILE_CONTENT
+        assert r["Content-Length"] == str(len(self.TEST_FILE_CONTENT))
+        assert r["Accept-Ranges"] == "bytes"
+
+    @pytest.mark.django_db
+    def test_should_stream_partial_content(self, client):
+        model_instance = self.create_model_instance()
+
+        r = client.get('/file/%s/stream' % model_instance.pk, HTTP_RANGE="bytes=2-5")
+
+        assert 206 == r.status_code
+        assert b"".join(r.streaming_content) == self.TEST_FILE_CONTENT[2:6]
+        assert r["Content-Range"] == "bytes 2-5/%d" % len(self.TEST_FILE_CONTENT)
+
+    @pytest.mark.django_db
+    def test_should_reject_unsatisfiable_ranges(self, client):
+        model_instance = self.create_model_instance()
+
+        r = client.get('/file/%s/stream' % model_instance.pk, HTTP_RANGE="bytes=1000-")
+
+        assert 416 == r.status_code
+
+    @pytest.mark.django_db
+    def test_should_answer_conditional_requests(self, client):
+        model_instance = self.create_model_instance()
+        url = '/file/%s/stream' % model_instance.pk
+
+        r = client.get(url)
+
+        assert 304 == client.get(url, HTTP_IF_NONE_MATCH=r["ETag"]).status_code
+        assert 304 == client.get(url, HTTP_IF_MODIFIED_SINCE=r["Last-Modified"]).status_code
+        assert 200 == client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code
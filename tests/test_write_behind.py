@@ -0,0 +1,190 @@
+# coding=utf-8
+import os
+import threading
+
+import pytest
+from django.core.files.base import ContentFile
+
+from django_gcloud_storage import write_behind
+from django_gcloud_storage.write_behind import WriteBehindUploader
+
+from helpers import FakeBucket
+
+
+class BlockingBucket(FakeBucket):
+    def __init__(self):
+        super(BlockingBucket, self).__init__()
+        self.release = threading.Event()
+        self.fail = False
+
+    def before_upload(self, name):
+        assert self.release.wait(5)
+        if self.fail:
+            raise IOError("Upload failed")
+
+
+@pytest.fixture
+def write_behind_storage(offline_storage, tmp_path):
+    offline_storage._bucket = BlockingBucket()
+    offline_storage.write_behind = True
+    offline_storage.write_behind_dir = str(tmp_path / "journal")
+
+    yield offline_storage
+
+    offline_storage._bucket.release.set()
+
+
+# noinspection PyClassHasNoInit,PyMethodMayBeStatic
+class TestWriteBehind:
+    CONTENT = "Brathähnchen".encode("utf8")
+
+    def test_should_serve_pending_uploads_locally(self, write_behind_storage):
+        name = write_behind_storage.save("pending.txt", ContentFile(self.CONTENT))
+
+        assert write_behind_storage._bucket.objects == {}
+        assert write_behind_storage.exists(name)
+        assert write_behind_storage.size(name) == len(self.CONTENT)
+        assert write_behind_storage.open(name).read() == self.CONTENT
+
+    def test_should_upload_in_background(self, write_behind_storage):
+        name = write_behind_storage.save("uploaded.txt", ContentFile(self.CONTENT))
+        write_behind_storage._bucket.release.set()
+
+        assert write_behind_storage.flush(timeout=5)
+        assert write_behind_storage._bucket.objects[name] == self.CONTENT
+        assert os.listdir(write_behind_storage.write_behind_dir) == []
+
+    def test_should_upload_changed_files_in_background(self, write_behind_storage):
+        write_behind_storage._bucket.release.set()
+
+        with write_behind_storage.open("changed.txt", "wb") as f:
+            f.write(self.CONTENT)
+
+        assert write_behind_storage.wait("changed.txt", timeout=5)
+        assert write_behind_storage._bucket.objects["changed.txt"] == self.CONTENT
+
+    def test_wait_should_raise_failed_uploads(self, write_behind_storage):
+        write_behind_storage._bucket.fail = True
+        name = write_behind_storage.save("failing.txt", ContentFile(self.CONTENT))
+        write_behind_storage._bucket.release.set()
+
+        with pytest.raises(IOError):
+            write_behind_storage.wait(name, timeout=5)
+
+        # Still served from the journal
+        assert write_behind_storage.open(name).read() == self.CONTENT
+
+    def test_should_retry_failed_uploads(self, write_behind_storage, monkeypatch):
+        monkeypatch.setattr(write_behind, "RETRY_INTERVAL", 0.01)
+        write_behind_storage._bucket.fail = True
+        name = write_behind_storage.save("retried.txt", ContentFile(self.CONTENT))
+        write_behind_storage._bucket.release.set()
+
+        with pytest.raises(IOError):
+            write_behind_storage.wait(name, timeout=5)
+        with pytest.raises(IOError):
+            write_behind_storage.flush(timeout=5)
+
+        write_behind_storage._bucket.fail = False
+
+        for _ in range(50):
+            if write_behind_storage.uploader.get_pending(name) is None:
+                break
+            threading.Event().wait(0.1)
+
+        assert write_behind_storage.flush(timeout=5)
+        assert write_behind_storage._bucket.objects[name] == self.CONTENT
+        assert os.listdir(write_behind_storage.write_behind_dir) == []
+
+    def test_delete_should_cancel_failed_uploads(self, write_behind_storage, monkeypatch):
+        monkeypatch.setattr(write_behind, "RETRY_INTERVAL", 60)
+        write_behind_storage._bucket.fail = True
+        name = write_behind_storage.save("deleted.txt", ContentFile(self.CONTENT))
+        write_behind_storage._bucket.release.set()
+        with pytest.raises(IOError):
+            write_behind_storage.wait(name, timeout=5)
+
+        write_behind_storage.delete(name)
+
+        assert not write_behind_storage.exists(name)
+        assert write_behind_storage.flush(timeout=5)
+        assert os.listdir(write_behind_storage.write_behind_dir) == []
+
+    def test_reading_should_not_upload_again(self, write_behind_storage):
+        write_behind_storage._bucket.release.set()
+        write_behind_storage._bucket.objects["read.txt"] = self.CONTENT
+
+        with write_behind_storage.open("read.txt") as f:
+            assert f.read() == self.CONTENT
+
+        assert write_behind_storage.uploader.get_pending("read.txt") is None
+        assert write_behind_storage._bucket.uploads == 0
+
+    def test_should_not_resume_completed_entries(self, write_behind_storage):
+        os.makedirs(write_behind_storage.write_behind_dir)
+        with open(os.path.join(write_behind_storage.write_behind_dir, "1-completed.json"), "w") as f:
+            f.write('{"bucket": "offline-bucket", "name": "completed.txt", "content_type": null}')
+
+        uploader = WriteBehindUploader(
+            write_behind_storage,
+            write_behind_storage.write_behind_dir,
+            workers=1,
+            max_pending=10
+        )
+
+        uploader._recover()
+
+        assert uploader.get_pending("completed.txt") is None
+
+    def test_should_resume_journaled_uploads(self, write_behind_storage, monkeypatch):
+        # Only the new uploader should pick the entry up
+        monkeypatch.setattr(write_behind, "RETRY_INTERVAL", 60)
+        write_behind_storage._bucket.fail = True
+        write_behind_storage._bucket.release.set()
+        name = write_behind_storage.save("resumed.txt", ContentFile(self.CONTENT))
+        with pytest.raises(IOError):
+            write_behind_storage.wait(name, timeout=5)
+
+        # Simulate the owning process going away
+        write_behind_storage.uploader.get_pending(name).journal_file.close()
+        write_behind_storage._bucket.fail = False
+
+        WriteBehindUploader(
+            write_behind_storage,
+            write_behind_storage.write_behind_dir,
+            workers=1,
+            max_pending=10
+        )
+
+        for _ in range(50):
+            if name in write_behind_storage._bucket.objects:
+                break
+            threading.Event().wait(0.1)
+
+        assert write_behind_storage._bucket.objects[name] == self.CONTENT
+
+    def test_should_reset_uploaders_in_forked_processes(self, write_behind_storage, monkeypatch):
+        write_behind_storage._bucket.release.set()
+        monkeypatch.setattr(write_behind, "_uploaders", {})
+        inherited = write_behind_storage.uploader
+        monkeypatch.setattr(os, "getpid", lambda: inherited.pid + 1)
+
+        write_behind._reset_uploaders()
+
+        assert write_behind._uploaders == {}
+        assert write_behind_storage.uploader is not inherited
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires fork()")
+    def test_forked_processes_should_upload(self, write_behind_storage, monkeypatch):
+        write_behind_storage._bucket.release.set()
+        monkeypatch.setattr(write_behind, "_uploaders", {})
+        assert write_behind_storage.uploader is not None
+
+        pid = os.fork()
+        if pid == 0:
+            name = write_behind_storage.save("forked.txt", ContentFile(self.CONTENT))
+            uploaded = write_behind_storage.flush(timeout=5) and name in write_behind_storage._bucket.objects
+            os._exit(0 if uploaded else 1)
+
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0